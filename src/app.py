@@ -8,83 +8,318 @@ st.set_page_config(
     layout="wide"
 )
 
-import json
 import os
 import sys
 
 # Добавляем путь к модулям
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from text_processor import download_nltk_data, clean_and_normalize
-from tfidf import compute_tfidf, compute_artist_tfidf
-from collections import Counter
-import math
+from text_processor import DEFAULT_TOKENIZER, clean_and_normalize, iter_normalize
+from tfidf import CorpusStats, compute_idf, compute_tfidf, compute_artist_tfidf
+from sparse_tfidf import SparseTfidfMatrix, Vocabulary, compute_sparse_tfidf
+from corpus_io import find_corpus, iter_corpus
+import instrumentation
+from instrumentation import span, timed_iter
+from query_index import QueryIndex, song_title, top_k
+from similarity import SimilarityIndex
+from search import SearchIndex
+from mapped_model import MappedModel, write_model
+from artifact_cache import (
+    ArtifactCache, compute_cache_key, pack_tokens, unpack_tokens, pack_weights, unpack_weights,
+)
+from array import array
+from collections import deque
 
-# Загрузка NLTK-ресурсов
-@st.cache_resource
-def init_nltk():
-    download_nltk_data()
+# Хранилище TF-IDF по песням: "dict" (список словарей) или "sparse" (CSR-буферы)
+TFIDF_BACKEND = os.environ.get("TFIDF_BACKEND", "dict")
 
-init_nltk()
+# Параллельная предобработка: число процессов (0 — по числу ядер) и размер блока
+NORMALIZE_WORKERS = int(os.environ.get("NORMALIZE_WORKERS", "1")) or None
+NORMALIZE_CHUNKSIZE = int(os.environ.get("NORMALIZE_CHUNKSIZE", "256"))
 
-# Загрузка и обработка данных (с кэшированием)
-@st.cache_data
-def load_and_process_data():
-    # Определяем путь к данным
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    data_path = os.path.join(current_dir, "lyrics_data", "lyrics_all.json")
-    
-    # Альтернативный путь для Streamlit Cloud
-    if not os.path.exists(data_path):
-        data_path = "lyrics_data/lyrics_all.json"
-    
-    with open(data_path, "r", encoding="utf-8") as f:
-        raw_data = json.load(f)
-    
-    processed = []
-    for item in raw_data:
-        lyrics = item.get("lyrics", "")
-        if not lyrics or not isinstance(lyrics, str):
-            continue
-        
-        tokens = clean_and_normalize(lyrics)
-        if len(tokens) < 10:
+# NLTK-ресурсы загружаются лениво, при первой нормализации текста (промах кэша
+# артефактов или поисковый запрос), а не до первой отрисовки страницы.
+# С NLTK_PREWARMED=1 (после "python text_processor.py --prewarm") проверки пропускаются.
+
+# Постоянный кэш артефактов (пустая строка отключает его)
+ARTIFACT_CACHE_DIR = os.environ.get(
+    "ARTIFACT_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".artifact_cache"),
+)
+
+# Режим общей модели: реплики открывают один файл модели через mmap (только чтение)
+# вместо того, чтобы держать корпус и веса в памяти каждого процесса
+MAPPED_MODEL = os.environ.get("MAPPED_MODEL") == "1"
+
+# Сколько слов предвычисляется для топ-списков интерфейса
+TOP_K = 15
+
+# Сколько похожих песен/артистов показывать; таблицу соседей всех песен можно
+# построить при загрузке (PRECOMPUTE_SONG_NEIGHBOURS=1), по умолчанию соседи ищутся по запросу.
+# В файл общей модели (MAPPED_MODEL=1) таблица записывается всегда: реплики не строят индекс сами
+SIMILAR_K = 5
+PRECOMPUTE_SONG_NEIGHBOURS = os.environ.get("PRECOMPUTE_SONG_NEIGHBOURS", "0") == "1"
+
+# Похожие песни ищутся точно. На корпусах больше SONG_SIMILARITY_APPROX_ABOVE песен полный
+# обход постингов частых слов стоит O(N) на запрос, поэтому индекс ограничивается: без частых
+# слов, с урезанными постингами; кандидаты пересчитываются точно, но соседи приближённые
+SONG_SIMILARITY_APPROX_ABOVE = int(os.environ.get("SONG_SIMILARITY_APPROX_ABOVE", "20000"))
+SONG_SIMILARITY_OPTIONS = {"max_query_terms": 64, "max_df": 0.1, "max_postings": 1000}
+
+# Песни с меньшим числом токенов после нормализации отбрасываются
+MIN_SONG_TOKENS = 10
+
+# Настройки предобработки, от которых зависят артефакты (входят в ключ кэша)
+PREPROCESSING_SETTINGS = {
+    "min_song_tokens": MIN_SONG_TOKENS,
+    "min_token_length": 3,
+    "tokenizer": DEFAULT_TOKENIZER,
+    "stopwords": "nltk-english",
+    "lemmatizer": "wordnet",
+}
+
+
+def iter_songs(records):
+    """Потоковая предобработка записей корпуса (один пул процессов на весь поток)."""
+    # Записи, тексты которых уже отданы на нормализацию, но ещё не вернулись
+    pending = deque()
+    
+    def texts():
+        for item in records:
+            lyrics = item.get("lyrics")
+            if not lyrics or not isinstance(lyrics, str):
+                continue
+            pending.append(item)
+            yield lyrics
+    
+    all_song_tokens = iter_normalize(texts(), workers=NORMALIZE_WORKERS, chunksize=NORMALIZE_CHUNKSIZE)
+    for tokens in all_song_tokens:
+        item = pending.popleft()
+        if len(tokens) < MIN_SONG_TOKENS:
             continue
         
-        processed.append({
+        yield {
             "artist": item["artist"],
             "song_url": item["song_url"],
-            "original_lyrics": lyrics,
+            "original_lyrics": item["lyrics"],
             "tokens": tokens
-        })
+        }
+
+
+def build_artifacts(records):
+    """Предобработка корпуса (итерируемого источника записей) и вычисление TF-IDF (без кэша)."""
+    with span("app.preprocess") as s:
+        processed = list(iter_songs(timed_iter("app.read_corpus", records)))
+        s.items = len(processed)
     
-    # Вычисляем TF-IDF
+    # Вычисляем статистику корпуса (один проход) и TF-IDF
     corpus_tokens = [item["tokens"] for item in processed]
-    tfidf_scores = compute_tfidf(corpus_tokens)
-    artist_tfidf = compute_artist_tfidf(processed)
+    with span("app.corpus_stats", items=len(corpus_tokens)):
+        stats = CorpusStats(corpus_tokens)
+        idf = compute_idf(index=stats)
+    with span("app.song_tfidf", items=len(corpus_tokens)):
+        if TFIDF_BACKEND == "sparse":
+            tfidf_scores = compute_sparse_tfidf(corpus_tokens).rows()
+        else:
+            tfidf_scores = compute_tfidf(corpus_tokens, idf=idf)
+    with span("app.artist_tfidf"):
+        artist_tfidf = compute_artist_tfidf(processed, idf=idf)
+    
+    return processed, tfidf_scores, artist_tfidf, stats
+
+
+def pack_artifacts(processed, tfidf_scores, artist_tfidf, stats):
+    """Упаковка результатов обработки для постоянного кэша."""
+    terms, offsets, token_ids = pack_tokens(item["tokens"] for item in processed)
+    artists = list(artist_tfidf)
+    return {
+        "songs": [
+            {"artist": item["artist"], "song_url": item["song_url"], "original_lyrics": item["original_lyrics"]}
+            for item in processed
+        ],
+        "terms": terms,
+        "token_offsets": offsets,
+        "token_ids": token_ids,
+        "df": array("l", (stats.df(term) for term in terms)),
+        "term_freq": array("l", (stats.term_freq[term] for term in terms)),
+        "tfidf": pack_weights(tfidf_scores, terms),
+        "artists": artists,
+        "artist_tfidf": pack_weights((artist_tfidf[artist] for artist in artists), terms),
+    }
+
+
+def unpack_artifacts(artifacts):
+    """Восстановление результатов обработки из постоянного кэша."""
+    terms = artifacts["terms"]
+    corpus_tokens = unpack_tokens(terms, artifacts["token_offsets"], artifacts["token_ids"])
+    processed = [dict(song, tokens=tokens) for song, tokens in zip(artifacts["songs"], corpus_tokens)]
+    
+    if TFIDF_BACKEND == "sparse":
+        tfidf_scores = SparseTfidfMatrix.from_weights(Vocabulary(terms), *artifacts["tfidf"]).rows()
+    else:
+        tfidf_scores = unpack_weights(terms, *artifacts["tfidf"])
+    artist_tfidf = dict(zip(artifacts["artists"], unpack_weights(terms, *artifacts["artist_tfidf"])))
+    
+    # Статистика восстанавливается из сохранённых счётчиков, без прохода по токенам
+    offsets = artifacts["token_offsets"]
+    stats = CorpusStats.from_counts(
+        dict(zip(terms, artifacts["df"])),
+        dict(zip(terms, artifacts["term_freq"])),
+        (offsets[i + 1] - offsets[i] for i in range(len(offsets) - 1)),
+    )
+    return processed, tfidf_scores, artist_tfidf, stats
+
+
+def find_data_path():
+    """Путь к корпусу (JSONL предпочтительнее старого lyrics_all.json)."""
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    data_path = find_corpus(os.path.join(current_dir, "lyrics_data"))
     
-    # Дополнительная статистика
-    all_tokens = [token for item in processed for token in item["tokens"]]
-    word_freq = Counter(all_tokens)
-    total_words = len(all_tokens)
+    # Альтернативный путь для Streamlit Cloud
+    if data_path is None:
+        data_path = find_corpus("lyrics_data")
+    if data_path is None:
+        raise FileNotFoundError("Не найден корпус lyrics_all.jsonl / lyrics_all.json")
+    return data_path
+
+
+def load_artifacts(data_path):
+    """Результаты обработки корпуса: из постоянного кэша или вычисленные заново."""
+    # Сначала пробуем постоянный кэш (общий для процессов и перезапусков)
+    cache = ArtifactCache(ARTIFACT_CACHE_DIR) if ARTIFACT_CACHE_DIR else None
+    cache_key = compute_cache_key(data_path, PREPROCESSING_SETTINGS) if cache else None
+    with span("app.artifact_cache_load"):
+        artifacts = cache.load(cache_key) if cache else None
+    
+    if artifacts is not None:
+        with span("app.artifact_cache_unpack"):
+            return unpack_artifacts(artifacts)
+    
+    processed, tfidf_scores, artist_tfidf, stats = build_artifacts(iter_corpus(data_path))
+    if cache:
+        try:
+            cache.save(cache_key, pack_artifacts(processed, tfidf_scores, artist_tfidf, stats))
+        except OSError as e:
+            print(f"Не удалось сохранить кэш артефактов: {e}")
+    return processed, tfidf_scores, artist_tfidf, stats
+
+
+# Загрузка и обработка данных (с кэшированием)
+# cache_resource, а не cache_data: данные только читаются, и так они не копируются
+# (не проходят через pickle) при каждом перезапуске скрипта
+@st.cache_resource
+def load_and_process_data():
+    processed, tfidf_scores, artist_tfidf, stats = load_artifacts(find_data_path())
     
-    # Вычисляем IDF
-    N = len(processed)
-    word_idf = {}
-    for word in word_freq:
-        docs_containing_word = sum(1 for doc_tokens in corpus_tokens if word in doc_tokens)
-        word_idf[word] = math.log(N / docs_containing_word) if docs_containing_word > 0 else 0
+    corpus_tokens = [item["tokens"] for item in processed]
+    
+    # Дополнительная статистика
+    word_freq = stats.term_freq
+    total_words = stats.total_tokens
+    word_idf = stats.idf_dict()
+    word_df = stats.doc_freq
+    N = stats.num_docs
     
     # Добавляем TF-IDF к каждому документу
     for i, item in enumerate(processed):
         item["tfidf"] = tfidf_scores[i]
     
-    return processed, corpus_tokens, tfidf_scores, artist_tfidf, word_freq, total_words, word_idf, N
+    return processed, corpus_tokens, tfidf_scores, artist_tfidf, word_freq, total_words, word_idf, N, word_df
+
+# Файл общей модели (MAPPED_MODEL=1): строится первой репликой, остальные только открывают его.
+# Имя файла — ключ кэша, поэтому изменение корпуса или настроек даёт новую модель
+@st.cache_resource
+def load_mapped_model():
+    data_path = find_data_path()
+    model_dir = ARTIFACT_CACHE_DIR or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".artifact_cache")
+    settings = dict(PREPROCESSING_SETTINGS, top_k=TOP_K, similar_k=SIMILAR_K,
+                    song_similarity=SONG_SIMILARITY_OPTIONS,
+                    song_similarity_approx_above=SONG_SIMILARITY_APPROX_ABOVE)
+    model_path = os.path.join(model_dir, f"{compute_cache_key(data_path, settings)}.lyrmodel")
+    if not os.path.exists(model_path):
+        with span("app.write_mapped_model"):
+            processed, tfidf_scores, artist_tfidf, stats = load_artifacts(data_path)
+            write_model(model_path, processed, tfidf_scores, artist_tfidf, stats, k=TOP_K, similar_k=SIMILAR_K,
+                        song_neighbours=True,
+                        song_similarity_options=song_similarity_options(len(processed)))
+    with span("app.open_mapped_model"):
+        return MappedModel(model_path)
+
+def load_view():
+    """Данные для страницы: (песни, таблицы запросов, соседи песен, соседи артистов,
+    число слов, размер словаря, число песен)."""
+    if MAPPED_MODEL:
+        model = load_mapped_model()
+        return (model.songs, model, model.song_neighbours, model.artist_neighbours,
+                model.total_tokens, model.vocabulary_size, model.num_docs)
+    processed, _, _, _, word_freq, total_words, _, N, _ = load_and_process_data()
+    song_similarity, artist_similarity = load_similarity_indexes()
+    return processed, load_query_index(), song_similarity, artist_similarity, total_words, len(word_freq), N
+
+def display_diagnostics():
+    """Панель диагностики (при PIPELINE_PROFILE=1): время и память этапов загрузки."""
+    if not instrumentation.is_enabled():
+        return
+    with st.sidebar.expander("Диагностика производительности"):
+        stages = instrumentation.summary()
+        if stages:
+            st.table([
+                {
+                    "этап": path,
+                    "вызовов": stage["calls"],
+                    "время, с": round(stage["wall_seconds"], 4),
+                    "CPU, с": round(stage["cpu_seconds"], 4),
+                    "объём": stage["items"],
+                    "пик памяти, МиБ": round(stage["peak_bytes"] / 2**20, 1) if stage["peak_bytes"] is not None else None,
+                }
+                for path, stage in stages.items()
+            ])
+        else:
+            st.write("Данные загружены из кэша, замеров нет.")
+        st.download_button("Скачать JSON", instrumentation.export_json(), file_name="pipeline_profile.json",
+                           mime="application/json")
+
+# Таблицы для быстрых ответов интерфейса: строятся один раз, общие для всех перезапусков
+@st.cache_resource
+def load_query_index():
+    processed, _, _, artist_tfidf, word_freq, _, word_idf, _, word_df = load_and_process_data()
+    return QueryIndex(processed, artist_tfidf, word_idf, word_df, word_freq, k=TOP_K)
+
+def song_similarity_options(num_songs):
+    """Параметры индекса похожих песен: пустые (точный поиск), если корпус небольшой."""
+    if num_songs <= SONG_SIMILARITY_APPROX_ABOVE:
+        return {}
+    return SONG_SIMILARITY_OPTIONS
+
+# Индексы похожих песен и артистов (косинус по TF-IDF) с предвычисленными соседями
+@st.cache_resource
+def load_similarity_indexes():
+    processed, _, tfidf_scores, artist_tfidf, *_ = load_and_process_data()
+    song_index = SimilarityIndex(tfidf_scores, **song_similarity_options(len(tfidf_scores)))
+    artists = sorted(artist_tfidf)
+    artist_index = SimilarityIndex((artist_tfidf[a] for a in artists), keys=artists)
+    artist_index.precompute_neighbours(SIMILAR_K)
+    if PRECOMPUTE_SONG_NEIGHBOURS:
+        song_index.precompute_neighbours(SIMILAR_K)
+    return song_index, artist_index
+
+# Поисковые индексы (BM25 и TF-IDF) по токенам песен
+@st.cache_resource
+def load_search_index(scoring):
+    if MAPPED_MODEL:
+        # Постинги остаются видами на файл модели
+        model = load_mapped_model()
+        return SearchIndex.from_postings(model.postings(), model.doc_lengths, scoring=scoring,
+                                         analyzer=clean_and_normalize)
+    _, corpus_tokens, *_ = load_and_process_data()
+    return SearchIndex(corpus_tokens, scoring=scoring, analyzer=clean_and_normalize)
 
 def display_top_words(tfidf_dict, title, num_words=10):
     """Утилита для отображения топ-N слов."""
-    top_words = sorted(tfidf_dict.items(), key=lambda x: x[1], reverse=True)[:num_words]
-    
+    display_top_items(top_k(tfidf_dict, num_words), title)
+
+def display_top_items(top_words, title):
+    """Отображение уже отобранных пар (слово, вес)."""
     st.subheader(title)
     if top_words:
         cols = st.columns(2)
@@ -143,50 +378,65 @@ def main():
     st.markdown("---")
     
     try:
-        processed_data, _, _, artist_tfidf, word_freq, total_words, word_idf, N = load_and_process_data()
+        processed_data, query, song_similarity, artist_similarity, total_words, vocabulary_size, N = load_view()
     except Exception as e:
         st.error(f"Ошибка при загрузке данных: {e}")
         return
     
     if not processed_data:
-        st.warning("Нет данных для отображения. Проверьте файл lyrics_all.json.")
+        st.warning("Нет данных для отображения. Проверьте файл lyrics_all.jsonl (или lyrics_all.json).")
         return
     
+    display_diagnostics()
+    
     # Статистика по корпусу
     st.header("Общая статистика по корпусу")
     st.markdown(
-        f"Всего **{len(processed_data)} песен** от **{len(set(item['artist'] for item in processed_data))} артистов**"
+        f"Всего **{len(processed_data)} песен** от **{len(query.artists)} артистов**"
     )
-    st.markdown(f"Всего **{total_words} слов** (**{len(word_freq)} уникальных слов**)")
+    st.markdown(f"Всего **{total_words} слов** (**{vocabulary_size} уникальных слов**)")
     
     # Самые частые слова в корпусе
-    top_frequent = dict(word_freq.most_common(15))
     st.subheader("Самые частые слова во всем корпусе")
-    for word, freq in list(top_frequent.items())[:10]:
+    for word, freq in query.most_frequent(10):
         st.write(f"- **{word}**: встречается {freq} раз ({(freq / total_words * 100):.2f}%)")
     
     # Слова с highest IDF (самые редкие)
-    top_idf = sorted(word_idf.items(), key=lambda x: x[1], reverse=True)[:10]
     st.subheader("Самые редкие слова в корпусе (highest IDF)")
     st.markdown("встречаются в наименьшем количестве песен:")
-    for word, idf_score in top_idf:
-        docs_with_word = sum(1 for doc_tokens in [item["tokens"] for item in processed_data] if word in doc_tokens)
+    for word, idf_score, docs_with_word in query.rarest_words(10):
         st.write(f"- **{word}**: IDF = `{idf_score:.4f}` (всего в {docs_with_word} песнях из {N})")
     
     st.markdown("---")
     
+    # Поиск по текстам
+    st.header("Поиск по текстам песен")
+    search_query = st.text_input("Слова для поиска (например: midnight highway)", key="search_query")
+    scoring = st.radio("Ранжирование", ["bm25", "tfidf"], horizontal=True, key="search_scoring",
+                       format_func=lambda x: "BM25" if x == "bm25" else "TF-IDF")
+    if search_query.strip():
+        results = load_search_index(scoring).search(search_query, k=10)
+        if results:
+            for doc_id, score in results:
+                item = processed_data[doc_id]
+                st.write(f"- **{song_title(item['song_url'])}** ({item['artist']}): `{score:.4f}`")
+        else:
+            st.write("Ничего не найдено.")
+    
+    st.markdown("---")
+    
     # TF-IDF по артистам
     st.header("TF-IDF по артистам")
     st.markdown("""\
     **Рассматриваем все песни артиста как один "документ" и сравниваем с корпусом всех песен.**
     """)
     
-    artists = sorted(set(item["artist"] for item in processed_data))
+    artists = query.artists
     selected_artist_stats = st.selectbox("Выберите исполнителя для анализа", artists, key="artist_stats")
     
-    if selected_artist_stats in artist_tfidf:
-        display_top_words(artist_tfidf[selected_artist_stats],
-                         f"Топ-15 характерных слов для {selected_artist_stats}", 15)
+    artist_top_words = query.artist_top_words(selected_artist_stats, 15)
+    if artist_top_words is not None:
+        display_top_items(artist_top_words, f"Топ-15 характерных слов для {selected_artist_stats}")
         
         # Пояснение для артиста
         st.info(f"""\
@@ -195,6 +445,10 @@ def main():
         - Но при этом они редко встречаются у других артистов (высокий IDF)
         - Это делает их **уникальными** для творчества {selected_artist_stats}
         """)
+        
+        st.subheader("Артисты с похожей лексикой")
+        for artist, score in artist_similarity.most_similar(selected_artist_stats, SIMILAR_K):
+            st.write(f"- **{artist}**: косинусное сходство `{score:.4f}`")
     else:
         st.warning(f"Нет данных для артиста {selected_artist_stats}")
     
@@ -208,14 +462,7 @@ def main():
     
     selected_artist = st.selectbox("Выберите исполнителя", artists, key="artist_songs")
     
-    artist_songs = []
-    for i, item in enumerate(processed_data):
-        if item["artist"] == selected_artist:
-            slug = item["song_url"].split("/")[-1]
-            if slug.endswith("-lyrics"):
-                slug = slug[:-7]
-            name = slug.replace("-", " ").title()
-            artist_songs.append((i, name))
+    artist_songs = query.artist_songs(selected_artist)
     
     song_names = [name for _, name in artist_songs]
     if song_names:
@@ -223,9 +470,7 @@ def main():
                                           format_func=lambda x: song_names[x])
         
         doc_index = artist_songs[selected_song_index][0]
-        tfidf_dict = processed_data[doc_index]["tfidf"]
-        
-        display_top_words(tfidf_dict, "Топ-10 слов с наибольшим TF-IDF в этой песне:", 10)
+        display_top_items(query.doc_top_words(doc_index, 10), "Топ-10 слов с наибольшим TF-IDF в этой песне:")
         
         st.info(f"""\
         **Интерпретация для песни "{song_names[selected_song_index]}":**
@@ -234,6 +479,14 @@ def main():
         - Это **самые характерные слова** именно для этой композиции
         """)
         
+        if N > SONG_SIMILARITY_APPROX_ABOVE:
+            st.subheader("Похожие песни (по косинусному сходству TF-IDF, приближённый поиск)")
+        else:
+            st.subheader("Похожие песни (по косинусному сходству TF-IDF)")
+        for other_index, score in song_similarity.most_similar(doc_index, SIMILAR_K):
+            other = processed_data[other_index]
+            st.write(f"- **{song_title(other['song_url'])}** ({other['artist']}): `{score:.4f}`")
+        
         with st.expander("Показать оригинальный текст песни"):
             original_text = processed_data[doc_index]["original_lyrics"]
             if original_text.strip():
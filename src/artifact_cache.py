@@ -0,0 +1,188 @@
+# artifact_cache.py
+"""Постоянный дисковый кэш обработанного корпуса и TF-IDF.
+
+Артефакты (потоки токенов, словарь, документные частоты, веса TF-IDF)
+сохраняются в компактном бинарном виде: слова заменяются целочисленными id,
+числовые данные хранятся в буферах ``array``.
+Ключ записи — SHA-256 от входных данных и настроек предобработки, поэтому
+кэш можно разделять между процессами и машинами через общую файловую систему.
+
+Формат записи не исполняемый (без pickle), как у ``mapped_model``: ``_MAGIC``,
+длина заголовка (8 байт), JSON-заголовок со строками, списками и описанием
+секций ``[смещение, размер, тип]``, затем секции — буферы ``array``, сжатые
+zlib. Целые числа хранятся как 8-байтовые ("q"), вещественные — как "d",
+порядок байт всегда little-endian, поэтому запись переносима между платформами.
+"""
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+import zlib
+from array import array
+
+CACHE_FORMAT_VERSION = 3
+_MAGIC = b"LYRTFIDF"
+_HEADER_LEN = struct.Struct("<Q")
+# Метка секции в JSON-заголовке: {"__array__": номер секции}
+_ARRAY_KEY = "__array__"
+
+
+def compute_cache_key(data_path, settings=None):
+    """Ключ кэша: хэш содержимого файла данных и настроек предобработки."""
+    digest = hashlib.sha256()
+    digest.update(str(CACHE_FORMAT_VERSION).encode())
+    digest.update(json.dumps(settings or {}, sort_keys=True).encode("utf-8"))
+    with open(data_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def pack_tokens(corpus_tokens):
+    """Списки токенов -> (словарь, границы документов, id токенов)."""
+    vocab = {}
+    offsets = array("q", [0])
+    token_ids = array("l")
+    for doc_tokens in corpus_tokens:
+        for word in doc_tokens:
+            term_id = vocab.get(word)
+            if term_id is None:
+                term_id = vocab[word] = len(vocab)
+            token_ids.append(term_id)
+        offsets.append(len(token_ids))
+    return list(vocab), offsets, token_ids
+
+
+def unpack_tokens(terms, offsets, token_ids):
+    """Обратное преобразование ``pack_tokens``."""
+    return [
+        [terms[term_id] for term_id in token_ids[offsets[i]:offsets[i + 1]]]
+        for i in range(len(offsets) - 1)
+    ]
+
+
+def pack_weights(weight_dicts, terms):
+    """Список словарей ``{слово: вес}`` -> CSR-буферы (indptr, indices, data)."""
+    term_ids = {term: i for i, term in enumerate(terms)}
+    indptr = array("q", [0])
+    indices = array("l")
+    data = array("d")
+    for weights in weight_dicts:
+        for word, value in weights.items():
+            indices.append(term_ids[word])
+            data.append(value)
+        indptr.append(len(indices))
+    return indptr, indices, data
+
+
+def unpack_weights(terms, indptr, indices, data):
+    """Обратное преобразование ``pack_weights``."""
+    return [
+        {terms[indices[pos]]: data[pos] for pos in range(indptr[i], indptr[i + 1])}
+        for i in range(len(indptr) - 1)
+    ]
+
+
+def _portable_array(values):
+    """Буфер фиксированной ширины: целые -> "q", вещественные -> "d" (little-endian)."""
+    typecode = "d" if values.typecode in "fd" else "q"
+    if values.typecode not in (typecode, "l") or values.itemsize != 8:
+        values = array(typecode, values)
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def _encode(value, sections):
+    """Значение артефактов -> JSON-совместимое; буферы ``array`` выносятся в секции."""
+    if isinstance(value, array):
+        sections.append(_portable_array(value))
+        return {_ARRAY_KEY: len(sections) - 1}
+    if isinstance(value, dict):
+        return {key: _encode(item, sections) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item, sections) for item in value]
+    return value
+
+
+def _decode(value, sections):
+    if isinstance(value, dict):
+        if _ARRAY_KEY in value:
+            return sections[value[_ARRAY_KEY]]
+        return {key: _decode(item, sections) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode(item, sections) for item in value]
+    return value
+
+
+def _read_section(payload, offset, nbytes, typecode):
+    values = array(typecode)
+    values.frombytes(zlib.decompress(payload[offset:offset + nbytes]))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+class ArtifactCache:
+    """Каталог с артефактами, по одному файлу на ключ."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def load(self, key):
+        """Возвращает сохранённые артефакты или ``None``."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                if f.read(len(_MAGIC)) != _MAGIC:
+                    return None
+                (header_size,) = _HEADER_LEN.unpack(f.read(_HEADER_LEN.size))
+                if header_size > os.fstat(f.fileno()).st_size:
+                    raise ValueError("длина заголовка больше файла")
+                header = json.loads(f.read(header_size))
+                payload = f.read()
+            if header.get("version") != CACHE_FORMAT_VERSION:
+                return None
+            sections = [_read_section(payload, *section) for section in header["sections"]]
+            return _decode(header["artifacts"], sections)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError, IndexError, zlib.error, struct.error) as e:
+            print(f"Повреждённая запись кэша {path}: {e}")
+            return None
+
+    def save(self, key, artifacts):
+        """Атомарно записывает артефакты (запись через временный файл)."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        sections = []
+        encoded = _encode(artifacts, sections)
+        layout = []
+        blobs = []
+        position = 0
+        for values in sections:
+            blob = zlib.compress(values.tobytes())
+            layout.append([position, len(blob), values.typecode])
+            blobs.append(blob)
+            position += len(blob)
+        header = json.dumps(
+            {"version": CACHE_FORMAT_VERSION, "artifacts": encoded, "sections": layout}, ensure_ascii=False,
+        ).encode("utf-8")
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_MAGIC)
+                f.write(_HEADER_LEN.pack(len(header)))
+                f.write(header)
+                for blob in blobs:
+                    f.write(blob)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
@@ -0,0 +1,290 @@
+# benchmark.py
+"""Офлайн-бенчмарки предобработки и TF-IDF.
+
+Синтетический корпус генерируется детерминированно (по seed) с Zipf-распределением
+слов, поэтому замеры воспроизводимы и не требуют сети. Встроенный корпус
+из ``lyrics_data`` используется как дополнительный реальный набор данных.
+Для каждого размера корпуса измеряются время (лучшее из нескольких повторов)
+и пиковое выделение памяти (tracemalloc); результаты пишутся в JSON, два таких
+файла можно сравнить между коммитами.
+
+Примеры:
+    python benchmark.py run --sizes 100 1000 10000 --output before.json
+    python benchmark.py compare before.json after.json
+    python benchmark.py parity   # токенизаторы "nltk" и "fast" на lyrics_data
+    python benchmark.py imports  # бюджет времени импорта библиотечных модулей
+"""
+import argparse
+import bisect
+import gc
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from corpus_io import find_corpus, iter_corpus
+from tfidf import compute_artist_tfidf, compute_idf, compute_tf, compute_tfidf
+
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+
+# Модули, импорт которых не должен тянуть тяжёлые зависимости, и бюджет на импорт
+LIBRARY_MODULES = (
+    "tfidf", "text_processor", "sparse_tfidf", "corpus_io", "artifact_cache",
+    "query_index", "similarity", "search", "instrumentation",
+)
+HEAVY_MODULES = ("nltk", "numpy", "requests", "bs4", "streamlit")
+IMPORT_BUDGET_MS = 150
+_SYLLABLES = ("la", "na", "ri", "so", "ve", "ka", "mo", "di", "lu", "te", "ya", "be", "or", "an", "el")
+
+
+def _make_vocabulary(size, rng):
+    """Уникальные псевдослова из слогов (длиной не короче трёх букв)."""
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def generate_corpus(num_songs, num_artists=20, song_length=200, vocab_size=20000, zipf_s=1.1, seed=0):
+    """Синтетический корпус песен в формате ``lyrics_all`` (Zipf-распределение слов)."""
+    rng = random.Random(seed)
+    vocabulary = _make_vocabulary(vocab_size, rng)
+    rng.shuffle(vocabulary)
+    cum_weights = list(itertools.accumulate(1.0 / (rank ** zipf_s) for rank in range(1, vocab_size + 1)))
+    total = cum_weights[-1]
+
+    def draw(n):
+        return [vocabulary[bisect.bisect_left(cum_weights, rng.random() * total)] for _ in range(n)]
+
+    corpus = []
+    for i in range(num_songs):
+        artist = f"Artist-{i % num_artists}"
+        length = max(1, int(rng.gauss(song_length, song_length / 4)))
+        lines = [" ".join(draw(min(8, length - pos))) for pos in range(0, length, 8)]
+        corpus.append({
+            "artist": artist,
+            "song_url": f"https://genius.com/{artist}-song-{i}-lyrics",
+            "lyrics": "\n".join(lines),
+        })
+    return corpus
+
+
+def load_bundled_corpus():
+    """Встроенный корпус из lyrics_data (реальные тексты)."""
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lyrics_data")
+    path = find_corpus(data_dir)
+    return list(iter_corpus(path)) if path else []
+
+
+def measure(func, repeat=3):
+    """Время (лучшее из ``repeat``) и пиковая память одного вызова ``func``."""
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        func()
+        timings.append((time.perf_counter() - start, time.process_time() - cpu_start))
+    wall, cpu = min(timings)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": wall, "cpu_seconds": cpu, "peak_bytes": peak}
+
+
+def _nltk_normalizer():
+    """``clean_and_normalize``, если NLTK и его данные доступны без сети, иначе ``None``."""
+    try:
+        import nltk
+        for resource in ("tokenizers/punkt", "corpora/stopwords", "corpora/wordnet"):
+            nltk.data.find(resource)
+        from text_processor import clean_and_normalize
+    except (ImportError, LookupError):
+        return None
+    return clean_and_normalize
+
+
+def _benchmarks(records, include_preprocessing):
+    """Набор замеров (имя -> функция без аргументов) для одного корпуса."""
+    # Токены для TF-IDF берём простым разбиением, чтобы не зависеть от NLTK
+    corpus_tokens = [record["lyrics"].lower().split() for record in records]
+    processed = [{"artist": r["artist"], "tokens": t} for r, t in zip(records, corpus_tokens)]
+    benchmarks = {
+        "compute_tf": lambda: [compute_tf(tokens) for tokens in corpus_tokens],
+        "compute_idf": lambda: compute_idf(corpus_tokens),
+        "compute_tfidf": lambda: compute_tfidf(corpus_tokens),
+        "compute_artist_tfidf": lambda: compute_artist_tfidf(processed),
+    }
+    normalize = _nltk_normalizer() if include_preprocessing else None
+    if normalize is not None:
+        normalize("warm up")  # загрузка ресурсов не входит в замер
+        benchmarks["clean_and_normalize"] = lambda: [normalize(r["lyrics"]) for r in records]
+        from text_processor import TextProcessor
+        fast = TextProcessor(tokenizer="fast")
+        fast.normalize("warm up")
+        benchmarks["normalize_fast"] = lambda: fast.normalize_many(r["lyrics"] for r in records)
+    return benchmarks
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, seed=0, repeat=3, include_bundled=True,
+                   include_preprocessing=True, **corpus_options):
+    """Прогоняет все замеры; возвращает словарь, готовый к записи в JSON."""
+    datasets = [(f"synthetic-{size}", generate_corpus(size, seed=seed, **corpus_options)) for size in sizes]
+    if include_bundled:
+        bundled = load_bundled_corpus()
+        if bundled:
+            datasets.insert(0, ("bundled", bundled))
+
+    results = []
+    for dataset, records in datasets:
+        for name, func in _benchmarks(records, include_preprocessing).items():
+            # Предобработка через NLTK на больших корпусах слишком долгая для повторов
+            runs = 1 if name in ("clean_and_normalize", "normalize_fast") and len(records) > 10000 else repeat
+            result = measure(func, repeat=runs)
+            result.update(benchmark=name, dataset=dataset, num_docs=len(records))
+            results.append(result)
+            print(f"{dataset:>18} {name:<22} {result['seconds']:10.4f} s {result['peak_bytes'] / 2**20:10.1f} MiB")
+
+    return {
+        "meta": {
+            "revision": _git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "seed": seed,
+            "repeat": repeat,
+            "corpus_options": corpus_options,
+        },
+        "results": results,
+    }
+
+
+def check_import_budget(modules=LIBRARY_MODULES, budget_ms=IMPORT_BUDGET_MS):
+    """Импортирует каждый модуль в отдельном процессе и проверяет время и зависимости.
+
+    Возвращает список строк-нарушений (пустой, если всё в порядке).
+    """
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    probe = (
+        "import sys, time; t = time.perf_counter(); import {module}; "
+        "elapsed = (time.perf_counter() - t) * 1000; "
+        "heavy = [m for m in {heavy!r} if m in sys.modules]; "
+        "print(elapsed, ','.join(heavy))"
+    )
+    problems = []
+    for module in modules:
+        output = subprocess.check_output(
+            [sys.executable, "-c", probe.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=src_dir, env=dict(os.environ, PIPELINE_PROFILE=""),
+        ).decode().split()
+        elapsed = float(output[0])
+        heavy = output[1].split(",") if len(output) > 1 else []
+        print(f"{module:<18} {elapsed:8.1f} ms {' '.join(heavy)}")
+        if elapsed > budget_ms:
+            problems.append(f"{module}: импорт {elapsed:.1f} мс > {budget_ms} мс")
+        if heavy:
+            problems.append(f"{module}: при импорте загружены {', '.join(heavy)}")
+    return problems
+
+
+def compare_results(old, new):
+    """Отношения времени и памяти ``new / old`` по совпадающим замерам."""
+    def key(result):
+        return result["dataset"], result["benchmark"]
+
+    old_results = {key(r): r for r in old["results"]}
+    rows = []
+    for result in new["results"]:
+        base = old_results.get(key(result))
+        if base is None:
+            continue
+        rows.append({
+            "dataset": result["dataset"],
+            "benchmark": result["benchmark"],
+            "time_ratio": result["seconds"] / base["seconds"] if base["seconds"] else None,
+            "memory_ratio": result["peak_bytes"] / base["peak_bytes"] if base["peak_bytes"] else None,
+        })
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки предобработки и TF-IDF")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="выполнить замеры")
+    run.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    run.add_argument("--artists", type=int, default=20)
+    run.add_argument("--song-length", type=int, default=200)
+    run.add_argument("--vocab-size", type=int, default=20000)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--no-bundled", action="store_true", help="без встроенного корпуса lyrics_data")
+    run.add_argument("--no-preprocessing", action="store_true", help="без замера clean_and_normalize")
+    run.add_argument("--output", default="benchmark_results.json")
+
+    compare = commands.add_parser("compare", help="сравнить два файла результатов")
+    compare.add_argument("old")
+    compare.add_argument("new")
+
+    commands.add_parser("parity", help="проверить совпадение токенизаторов nltk и fast на lyrics_data")
+
+    imports = commands.add_parser("imports", help="проверить бюджет времени импорта модулей")
+    imports.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+
+    args = parser.parse_args(argv)
+    if args.command == "imports":
+        problems = check_import_budget(budget_ms=args.budget_ms)
+        for problem in problems:
+            print(problem)
+        return 1 if problems else 0
+    if args.command == "parity":
+        from text_processor import check_tokenizer_parity
+        records = load_bundled_corpus()
+        mismatches = check_tokenizer_parity(record.get("lyrics") for record in records)
+        for i, expected, actual in mismatches[:10]:
+            diff = next(j for j, pair in enumerate(zip(expected + [None], actual + [None])) if pair[0] != pair[1])
+            print(f"{records[i]['song_url']}: позиция {diff}: nltk {expected[diff:diff + 5]} / fast {actual[diff:diff + 5]}")
+        print(f"Проверено {len(records)} текстов, расхождений: {len(mismatches)}")
+        return 1 if mismatches else 0
+    if args.command == "run":
+        report = run_benchmarks(
+            sizes=args.sizes, seed=args.seed, repeat=args.repeat,
+            include_bundled=not args.no_bundled, include_preprocessing=not args.no_preprocessing,
+            num_artists=args.artists, song_length=args.song_length, vocab_size=args.vocab_size,
+        )
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены: {args.output}")
+    else:
+        with open(args.old, encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.new, encoding="utf-8") as f:
+            new = json.load(f)
+        for row in compare_results(old, new):
+            time_ratio = f"{row['time_ratio']:.2f}x" if row["time_ratio"] is not None else "—"
+            memory_ratio = f"{row['memory_ratio']:.2f}x" if row["memory_ratio"] is not None else "—"
+            print(f"{row['dataset']:>18} {row['benchmark']:<22} время {time_ratio:>8} память {memory_ratio:>8}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# corpus_io.py
+"""Построчный (JSONL) формат корпуса с потоковым чтением.
+
+Каждая песня — отдельная строка JSON ``{"artist", "song_url", "lyrics"}``.
+Файлы с расширением ``.gz`` сжимаются gzip. Запись идёт по одной песне,
+чтение — генератором, поэтому корпус никогда не загружается в память целиком.
+Старый формат (один JSON-массив, ``lyrics_all.json``) тоже читается.
+"""
+import gzip
+import json
+import os
+import zlib
+
+CORPUS_BASENAME = "lyrics_all"
+CORPUS_EXTENSIONS = (".jsonl.gz", ".jsonl", ".json")
+
+# Сжатый файл сбрасывается на диск раз в столько записей: сброс после каждой
+# строки заставляет zlib завершать блок и заметно ухудшает сжатие
+GZIP_FLUSH_EVERY = 100
+
+
+def _open_text(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def find_corpus(data_dir, basename=CORPUS_BASENAME):
+    """Путь к корпусу в папке: JSONL (сжатый или нет) предпочтительнее JSON."""
+    for ext in CORPUS_EXTENSIONS:
+        path = os.path.join(data_dir, basename + ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def iter_corpus(path):
+    """Генератор записей корпуса."""
+    if path.endswith(".json"):
+        # Старый монолитный формат: поток невозможен, читаем целиком
+        with open(path, "r", encoding="utf-8") as f:
+            yield from json.load(f)
+        return
+    with _open_text(path, "r") as f:
+        line_no = 0
+        try:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    # Оборванная последняя строка после сбоя записи не должна ломать чтение
+                    print(f"Пропущена повреждённая строка {line_no} в {path}: {e}")
+        except (EOFError, gzip.BadGzipFile, zlib.error) as e:
+            # Оборванный хвост сжатого файла: всё прочитанное до него сохраняется
+            print(f"Файл {path} оборван после строки {line_no}: {e}")
+
+
+class CorpusWriter:
+    """Построчная запись корпуса.
+
+    Несжатый файл сбрасывается на диск после каждой песни, сжатый —
+    раз в ``flush_every`` песен (по умолчанию ``GZIP_FLUSH_EVERY``).
+    """
+
+    def __init__(self, path, append=False, flush_every=None):
+        self.path = path
+        self.count = 0
+        if flush_every is None:
+            flush_every = GZIP_FLUSH_EVERY if path.endswith(".gz") else 1
+        self.flush_every = flush_every
+        self._file = _open_text(path, "a" if append else "w")
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False))
+        self._file.write("\n")
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self._file.flush()
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def write_corpus(path, records):
+    """Записывает корпус целиком; возвращает число записей."""
+    with CorpusWriter(path) as writer:
+        writer.write_many(records)
+        return writer.count
+
+
+def convert_corpus(src_path, dst_path):
+    """Конвертирует корпус между форматами (например, JSON -> JSONL.gz)."""
+    return write_corpus(dst_path, iter_corpus(src_path))
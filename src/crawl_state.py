@@ -0,0 +1,131 @@
+# crawl_state.py
+"""Состояние обхода Genius для возобновляемого скрейпинга.
+
+Небольшая SQLite-база хранит уже загруженные страницы артистов и песни:
+тексты, хэши содержимого и валидаторы ETag/Last-Modified. При повторном
+запуске уже сохранённые песни пропускаются, а при обновлении используются
+условные запросы (304 Not Modified вместо полной страницы).
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artists (
+    slug TEXT PRIMARY KEY,
+    links TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS songs (
+    url TEXT PRIMARY KEY,
+    artist TEXT NOT NULL,
+    lyrics TEXT,
+    content_hash TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS songs_artist ON songs (artist);
+"""
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def conditional_headers(etag, last_modified):
+    """Заголовки условного запроса по сохранённым валидаторам."""
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+
+class CrawlState:
+    """Журнал обхода в SQLite; каждая запись сразу фиксируется на диске."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _query_one(self, sql, params):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def _write(self, sql, params):
+        with self._lock:
+            self._conn.execute(sql, params)
+            self._conn.commit()
+
+    # Страницы артистов
+
+    def artist_links(self, slug):
+        """Сохранённые ссылки на песни артиста или ``None``."""
+        row = self._query_one("SELECT links FROM artists WHERE slug = ?", (slug,))
+        return json.loads(row[0]) if row else None
+
+    def artist_headers(self, slug):
+        row = self._query_one("SELECT etag, last_modified FROM artists WHERE slug = ?", (slug,))
+        return conditional_headers(*row) if row else {}
+
+    def record_artist(self, slug, links, response=None):
+        etag, last_modified = _validators(response)
+        self._write(
+            "INSERT OR REPLACE INTO artists (slug, links, etag, last_modified, fetched_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (slug, json.dumps(links), etag, last_modified, time.time()),
+        )
+
+    # Песни
+
+    def has_song(self, url):
+        return self._query_one("SELECT 1 FROM songs WHERE url = ?", (url,)) is not None
+
+    def song_headers(self, url):
+        row = self._query_one("SELECT etag, last_modified FROM songs WHERE url = ?", (url,))
+        return conditional_headers(*row) if row else {}
+
+    def song_lyrics(self, url):
+        row = self._query_one("SELECT lyrics FROM songs WHERE url = ?", (url,))
+        return row[0] if row else None
+
+    def record_song(self, url, artist, lyrics, response=None):
+        """Сохраняет песню; возвращает ``True``, если текст изменился."""
+        new_hash = content_hash(lyrics) if lyrics else None
+        row = self._query_one("SELECT content_hash FROM songs WHERE url = ?", (url,))
+        etag, last_modified = _validators(response)
+        self._write(
+            "INSERT OR REPLACE INTO songs "
+            "(url, artist, lyrics, content_hash, etag, last_modified, fetched_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (url, artist, lyrics, new_hash, etag, last_modified, time.time()),
+        )
+        return row is None or row[0] != new_hash
+
+    def touch_song(self, url):
+        """Отмечает повторную проверку песни без изменений (ответ 304)."""
+        self._write("UPDATE songs SET fetched_at = ? WHERE url = ?", (time.time(), url))
+
+
+def _validators(response):
+    if response is None:
+        return None, None
+    return response.headers.get("ETag"), response.headers.get("Last-Modified")
@@ -0,0 +1,134 @@
+# fetcher.py
+"""Параллельная загрузка страниц с пулом соединений и ограничением частоты.
+
+Все запросы идут через одну ``requests.Session`` с пулом keep-alive
+соединений. Частота запросов к каждому хосту ограничивается отдельным
+token bucket, число одновременных запросов — размером пула потоков.
+Временные ошибки (таймауты, 429, 5xx) повторяются с экспоненциальной задержкой.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException, Timeout
+
+from instrumentation import observe
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class TokenBucket:
+    """Token bucket: не более ``rate`` запросов в секунду, всплеск до ``burst``."""
+
+    def __init__(self, rate, burst=1):
+        if rate <= 0:
+            raise ValueError("rate должен быть положительным")
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Ждёт, пока не освободится токен, и забирает его."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def penalize(self, delay):
+        """Откладывает следующие запросы (например, по заголовку Retry-After)."""
+        with self._lock:
+            self._tokens = min(self._tokens, 0.0) - delay * self.rate
+
+
+class Fetcher:
+    """Пул потоков для HTTP GET с ограничением частоты по хостам и повторами."""
+
+    def __init__(self, headers=None, max_workers=8, rate_per_host=0.5, burst=1,
+                 timeout=10, max_retries=3, backoff=1.0):
+        self.max_workers = max_workers
+        self.rate_per_host = rate_per_host
+        self.burst = burst
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        if headers:
+            self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _bucket(self, url):
+        host = urlsplit(url).netloc
+        with self._buckets_lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.rate_per_host, self.burst)
+            return bucket
+
+    def get(self, url, headers=None):
+        """GET с повторами; возвращает ответ или ``None`` при ошибке."""
+        bucket = self._bucket(url)
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            delay = self.backoff * (2 ** attempt)
+            if attempt:
+                observe("http.retries", 1)
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except Timeout:
+                observe("http.errors", 1)
+                print(f" Таймаут: {url}")
+            except RequestException as e:
+                observe("http.errors", 1)
+                print(f" Ошибка сети: {url} — {e}")
+            else:
+                observe("http.latency_seconds", time.perf_counter() - started)
+                observe("http.response_bytes", len(response.content))
+                if response.status_code not in RETRY_STATUSES:  # включая 304 Not Modified
+                    return response
+                retry_after = response.headers.get("Retry-After")
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+                    bucket.penalize(delay)
+                print(f" HTTP {response.status_code}: {url}")
+                if attempt == self.max_retries:
+                    return response
+            if attempt < self.max_retries:
+                time.sleep(delay)
+        return None
+
+    def submit(self, url, headers=None):
+        """Асинхронный GET; возвращает ``Future``."""
+        return self._executor.submit(self.get, url, headers)
+
+    def fetch_all(self, urls, headers=None):
+        """Загружает все URL параллельно; ответы в порядке входных URL."""
+        return list(self._executor.map(lambda url: self.get(url, headers), urls))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
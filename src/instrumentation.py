@@ -0,0 +1,238 @@
+# instrumentation.py
+"""Лёгкая инструментация этапов конвейера: время, CPU, объёмы и память.
+
+Этапы оборачиваются в ``span`` (контекстный менеджер) или ``timed``
+(декоратор). Пока инструментация выключена, ``span`` возвращает общий
+пустой объект, а счётчики ничего не делают — накладные расходы сводятся
+к проверке одного флага. Включается через ``enable()`` или переменную
+окружения ``PIPELINE_PROFILE=1`` (``PIPELINE_PROFILE=memory`` — вместе
+с замером пиковой памяти через tracemalloc, это заметно медленнее).
+
+Агрегаты по этапам копятся без ограничения, отдельные записи — только
+последние ``MAX_SPAN_RECORDS`` (этапы на уровне песни вызываются очень часто).
+Отчёт доступен через ``report()`` и экспортируется в JSON (``export_json``).
+Замеры внутри процессов-обработчиков (``normalize_parallel``) в отчёт
+основного процесса не попадают.
+"""
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+MAX_SPAN_RECORDS = 1000
+
+_enabled = False
+_track_memory = False
+_lock = threading.Lock()
+_local = threading.local()
+_spans = deque(maxlen=MAX_SPAN_RECORDS)
+_stages = {}
+_counters = {}
+
+
+class _NoopSpan:
+    """Пустой span для выключенной инструментации."""
+
+    items = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    """Замер одного этапа; ``items`` можно задать внутри блока ``with``."""
+
+    def __init__(self, name, items=None):
+        self.name = name
+        self.items = items
+        self._child_peak = 0
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self.path = "/".join([s.name for s in stack] + [self.name])
+        if _track_memory and tracemalloc.is_tracing():
+            # Пик родителя до этого момента сбрасывается, поэтому сохраняем его
+            if stack:
+                stack[-1]._child_peak = max(stack[-1]._child_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        peak = None
+        if _track_memory and tracemalloc.is_tracing():
+            # Пик вложенных этапов сброшен ими же, поэтому учитываем его отдельно
+            peak = max(tracemalloc.get_traced_memory()[1], self._child_peak)
+        stack = _local.stack
+        stack.pop()
+        if stack and peak is not None:
+            stack[-1]._child_peak = max(stack[-1]._child_peak, peak)
+        _record(self.name, self.path, wall, cpu, self.items, peak, exc_type)
+        return False
+
+
+def _record(name, path, wall, cpu, items, peak=None, exc_type=None):
+    record = {
+        "name": name,
+        "path": path,
+        "wall_seconds": wall,
+        "cpu_seconds": cpu,
+        "items": items,
+        "peak_bytes": peak,
+        "error": exc_type.__name__ if exc_type else None,
+    }
+    with _lock:
+        _spans.append(record)
+        stage = _stages.get(path)
+        if stage is None:
+            stage = _stages[path] = {
+                "calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "items": 0, "peak_bytes": None,
+            }
+        stage["calls"] += 1
+        stage["wall_seconds"] += wall
+        stage["cpu_seconds"] += cpu
+        stage["items"] += items or 0
+        if peak is not None:
+            stage["peak_bytes"] = max(stage["peak_bytes"] or 0, peak)
+
+
+def enable(track_memory=False):
+    """Включает инструментацию (и, по желанию, замер пиковой памяти)."""
+    global _enabled, _track_memory
+    _enabled = True
+    _track_memory = track_memory
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global _enabled, _track_memory
+    _enabled = False
+    if _track_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _track_memory = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Очищает накопленные записи."""
+    with _lock:
+        _spans.clear()
+        _stages.clear()
+        _counters.clear()
+
+
+def span(name, items=None):
+    """Контекстный менеджер замера этапа ``name``."""
+    if not _enabled:
+        return _NOOP
+    return Span(name, items)
+
+
+def timed(name=None):
+    """Декоратор: каждый вызов функции — отдельный span."""
+    def decorator(func):
+        span_name = name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_iter(name, iterable):
+    """Замер времени, затраченного самим источником данных (генератором).
+
+    Полезно для потоковых этапов, перемежающихся с другими (например,
+    разбор JSONL во время предобработки): учитывается только время внутри
+    ``next()``, а число элементов записывается в ``items``.
+    """
+    if not _enabled:
+        return iterable
+    return _timed_iter(name, iter(iterable))
+
+
+def _timed_iter(name, iterator):
+    wall = cpu = 0.0
+    items = 0
+    try:
+        while True:
+            cpu_start = time.process_time()
+            wall_start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                wall += time.perf_counter() - wall_start
+                cpu += time.process_time() - cpu_start
+            items += 1
+            yield item
+    finally:
+        _record(name, name, wall, cpu, items)
+
+
+def observe(name, value):
+    """Добавляет наблюдение в счётчик ``name`` (число, сумма, минимум, максимум)."""
+    if not _enabled:
+        return
+    with _lock:
+        counter = _counters.get(name)
+        if counter is None:
+            _counters[name] = {"count": 1, "total": value, "min": value, "max": value}
+        else:
+            counter["count"] += 1
+            counter["total"] += value
+            counter["min"] = min(counter["min"], value)
+            counter["max"] = max(counter["max"], value)
+
+
+def summary():
+    """Агрегаты по этапам: число вызовов, суммарное время и объёмы, максимум памяти."""
+    with _lock:
+        return {path: dict(stage) for path, stage in _stages.items()}
+
+
+def report():
+    """Полный отчёт: последние записи этапов, агрегаты и счётчики."""
+    with _lock:
+        spans = list(_spans)
+        counters = {name: dict(counter) for name, counter in _counters.items()}
+    return {"spans": spans, "stages": summary(), "counters": counters}
+
+
+def export_json(path=None):
+    """Отчёт в JSON; при заданном ``path`` также записывается в файл."""
+    text = json.dumps(report(), ensure_ascii=False, indent=2)
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+    return text
+
+
+# Только "1" и "memory" включают замеры: "0" или пустое значение их не включают
+_profile_env = os.environ.get("PIPELINE_PROFILE", "")
+if _profile_env in ("1", "memory"):
+    enable(track_memory=_profile_env == "memory")
@@ -0,0 +1,191 @@
+# lyrics_extractor.py
+"""Экономное извлечение текста песни из HTML-страницы Genius.
+
+Вместо полного дерева BeautifulSoup со встроенным ``html.parser``:
+- JSON со старым форматом (``<script id="song-json">``) ищется прямо в тексте
+  страницы регулярным выражением, без разбора HTML;
+- для нового формата разбираются только блоки ``div[data-lyrics-container]``
+  (``SoupStrainer``), причём быстрым парсером lxml, если он установлен;
+- если на странице нет ни одного признака текста, разбор не выполняется вовсе.
+
+Разбор можно вынести в пул процессов (``ExtractionPool``), отдельный от
+потоков сетевого ввода-вывода. Результат совпадает с ``scrapper.parse_lyrics``;
+проверка на сохранённых страницах из ``fixtures/lyrics_pages`` (оба формата
+и страницы без текста) обоими парсерами: ``python lyrics_extractor.py [page.html ...]``.
+"""
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# Атрибут id целиком: ни "song-jsonp", ни data-id="song-json" не подходят. Регистр не важен
+# только в именах тега и атрибута; значение сравнивается точно, как в soup.find(id='song-json')
+_SONG_JSON_RE = re.compile(
+    r"""(?i:<script\b[^>]*?(?<![\w-])id)\s*=\s*(["']?)song-json\1(?=[\s>/])[^>]*>(.*?)(?i:</script)\s*>""",
+    re.DOTALL,
+)
+_CONTAINER_MARKER = "data-lyrics-container"
+
+# Сохранённые страницы для сверки с эталонным разбором
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "lyrics_pages")
+
+_parser = None
+
+
+def _parser_backend():
+    """Парсер для BeautifulSoup: "lxml", если установлен, иначе "html.parser"."""
+    global _parser
+    if _parser is None:
+        choice = os.environ.get("LYRICS_PARSER", "auto")
+        if choice == "auto":
+            try:
+                import lxml  # noqa: F401
+                choice = "lxml"
+            except ImportError:
+                choice = "html.parser"
+        _parser = choice
+    return _parser
+
+
+def _lyrics_from_song_json(html):
+    match = _SONG_JSON_RE.search(html)
+    if not match or not match.group(2):
+        return None
+    try:
+        data = json.loads(match.group(2))
+        lyrics = data.get('song', {}).get('lyrics', '').strip()
+    except (json.JSONDecodeError, AttributeError, TypeError):
+        return None
+    if not lyrics:
+        return None
+    # Очистка от недопустимых символов в строке
+    return lyrics.encode('utf-8', errors='ignore').decode('utf-8')
+
+
+def _lyrics_from_containers(html):
+    if _CONTAINER_MARKER not in html:
+        return None
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    only_containers = SoupStrainer('div', attrs={'data-lyrics-container': 'true'})
+    soup = BeautifulSoup(html, _parser_backend(), parse_only=only_containers)
+    lyrics_parts = []
+    for div in soup.find_all('div', attrs={'data-lyrics-container': 'true'}):
+        text = div.get_text(separator='\n').strip()
+        if text:
+            # Очистка каждой части
+            lyrics_parts.append(text.encode('utf-8', errors='ignore').decode('utf-8'))
+    lyrics = '\n'.join(lyrics_parts)
+    return lyrics if lyrics.strip() else None
+
+
+def extract_lyrics(html):
+    """Текст песни из HTML-страницы (строки) или ``None``."""
+    # Способ 1: через JSON (старый формат)
+    lyrics = _lyrics_from_song_json(html)
+    if lyrics:
+        return lyrics
+    # Способ 2: через data-lyrics-container (новый формат)
+    return _lyrics_from_containers(html)
+
+
+def extract_lyrics_from_bytes(content):
+    """То же для сырых байтов ответа (безопасная декодировка UTF-8)."""
+    return extract_lyrics(content.decode('utf-8', errors='ignore'))
+
+
+class ExtractionPool:
+    """Пул процессов для разбора страниц, отдельный от сетевых потоков.
+
+    При ``workers`` = 0 разбор выполняется синхронно в текущем процессе.
+    """
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        self._executor = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+
+    def submit(self, content):
+        """Разбор байтов страницы; возвращает ``Future`` с текстом или ``None``."""
+        if self._executor is None:
+            from concurrent.futures import Future
+            future = Future()
+            try:
+                future.set_result(extract_lyrics_from_bytes(content))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self._executor.submit(extract_lyrics_from_bytes, content)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def available_parsers():
+    """Парсеры BeautifulSoup для сверки: встроенный и lxml, если он установлен."""
+    parsers = ["html.parser"]
+    try:
+        import lxml  # noqa: F401
+        parsers.append("lxml")
+    except ImportError:
+        pass
+    return parsers
+
+
+def compare_with_reference(paths, parsers=None):
+    """Сравнивает результат с ``scrapper.parse_lyrics`` на сохранённых страницах.
+
+    Разбор повторяется для каждого парсера из ``parsers`` (по умолчанию —
+    ``available_parsers()``), независимо от ``LYRICS_PARSER``. Возвращает
+    список пар ``(парсер, путь)``, для которых результаты различаются.
+    """
+    global _parser
+    from scrapper import parse_lyrics
+
+    pages = []
+    for path in paths:
+        with open(path, "rb") as f:
+            decoded = f.read().decode('utf-8', errors='ignore')
+        pages.append((path, decoded, parse_lyrics(decoded)))
+
+    saved_parser = _parser
+    mismatches = []
+    try:
+        for parser in parsers or available_parsers():
+            _parser = parser
+            for path, decoded, expected in pages:
+                if extract_lyrics(decoded) != expected:
+                    mismatches.append((parser, path))
+    finally:
+        _parser = saved_parser
+    return mismatches
+
+
+def fixture_pages(fixtures_dir=FIXTURES_DIR):
+    """Пути сохранённых страниц из ``fixtures_dir`` (по имени файла)."""
+    return sorted(
+        os.path.join(fixtures_dir, name) for name in os.listdir(fixtures_dir) if name.endswith(".html")
+    )
+
+
+if __name__ == "__main__":
+    # python lyrics_extractor.py [saved_page.html ...] — проверка совпадения с эталонным разбором
+    # (без аргументов — на страницах из fixtures/lyrics_pages) каждым доступным парсером
+    pages = sys.argv[1:] or fixture_pages()
+    parsers = available_parsers()
+    mismatches = compare_with_reference(pages, parsers)
+    for parser, path in mismatches:
+        print(f"Расхождение ({parser}): {path}")
+    if "lxml" not in parsers:
+        print("lxml не установлен: проверен только html.parser")
+    print(f"Проверено страниц: {len(pages)}, парсеры: {', '.join(parsers)}, расхождений: {len(mismatches)}")
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,513 @@
+# mapped_model.py
+"""Модель TF-IDF в одном плоском файле, открываемом через mmap только для чтения.
+
+Файл содержит всё, что нужно интерфейсу: словарь, IDF/df/частоты слов,
+веса TF-IDF песен и артистов (CSR), постинги для поиска, таблицы топ-k слов
+и соседей, метаданные песен и сами тексты. Числовые секции читаются прямо
+из отображённой памяти (``memoryview.cast``), строки декодируются по запросу,
+поэтому несколько процессов (реплик Streamlit) на одной машине делят одни
+и те же страницы через кэш ОС, а открытие файла почти мгновенно.
+
+Формат: ``_MAGIC``, длина заголовка (8 байт), JSON-заголовок с описанием
+секций ``{имя: [смещение, размер, тип]}`` и сводными данными, затем секции,
+выровненные по 8 байт. Числа записываются в порядке байт машины (он указан
+в заголовке; файл с другим порядком не открывается).
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from collections import defaultdict
+from collections.abc import Mapping, Sequence
+
+from query_index import song_title, top_k
+from similarity import SimilarityIndex
+from sparse_tfidf import SparseRows, SparseRowView
+
+MODEL_FORMAT_VERSION = 1
+_MAGIC = b"LYRMODEL"
+_HEADER_LEN = struct.Struct("<Q")
+_ALIGN = 8
+
+
+def _string_table(strings):
+    """Строки -> (UTF-8 блок, границы строк)."""
+    blob = bytearray()
+    offsets = array("q", [0])
+    for s in strings:
+        blob += s.encode("utf-8")
+        offsets.append(len(blob))
+    return array("B", blob), offsets
+
+
+def _csr(rows, term_ids):
+    """Последовательность пар ``(слово, вес)`` по строкам -> (indptr, indices, data)."""
+    indptr = array("q", [0])
+    indices = array("i")
+    data = array("d")
+    for pairs in rows:
+        for word, value in pairs:
+            indices.append(term_ids[word])
+            data.append(value)
+        indptr.append(len(indices))
+    return indptr, indices, data
+
+
+def _neighbour_table(table, key_ids):
+    """Таблица соседей ``[[(ключ, сходство)]]`` -> (indptr, ids, scores)."""
+    indptr = array("q", [0])
+    ids = array("i")
+    scores = array("d")
+    for neighbours in table:
+        for key, score in neighbours:
+            ids.append(key_ids[key])
+            scores.append(score)
+        indptr.append(len(ids))
+    return indptr, ids, scores
+
+
+def write_model(path, processed, tfidf_scores, artist_tfidf, stats, k=15, similar_k=5, meta=None,
+                song_neighbours=False, song_similarity_options=None):
+    """Записывает модель в файл ``path`` (атомарно, через временный файл).
+
+    ``processed``, ``tfidf_scores``, ``artist_tfidf`` и ``stats`` — результат
+    ``app.build_artifacts``; ``k`` — длина топ-списков слов, ``similar_k`` —
+    число предвычисленных соседей. Соседи артистов записываются всегда, соседи
+    песен — только при ``song_neighbours`` (индекс строится с параметрами
+    ``song_similarity_options``). ``meta`` сохраняется в заголовке как есть.
+    """
+    terms = list(stats.vocabulary())
+    term_ids = {term: i for i, term in enumerate(terms)}
+    idf = stats.idf_dict()
+    artists = sorted(artist_tfidf)
+    artist_ids = {artist: i for i, artist in enumerate(artists)}
+
+    sections = {}
+    sections["terms_blob"], sections["terms_offsets"] = _string_table(terms)
+    sections["idf"] = array("d", (idf[term] for term in terms))
+    sections["df"] = array("q", (stats.df(term) for term in terms))
+    sections["term_freq"] = array("q", (stats.term_freq[term] for term in terms))
+
+    sections["artists_blob"], sections["artists_offsets"] = _string_table(artists)
+    sections["song_artist"] = array("i", (artist_ids[item["artist"]] for item in processed))
+    sections["urls_blob"], sections["urls_offsets"] = _string_table(item["song_url"] for item in processed)
+    sections["lyrics_blob"], sections["lyrics_offsets"] = _string_table(
+        item["original_lyrics"] for item in processed)
+    sections["doc_lengths"] = array("q", (len(item["tokens"]) for item in processed))
+
+    # Веса TF-IDF: песни и артисты
+    (sections["tfidf_indptr"], sections["tfidf_indices"],
+     sections["tfidf_data"]) = _csr((weights.items() for weights in tfidf_scores), term_ids)
+    (sections["artist_indptr"], sections["artist_indices"],
+     sections["artist_data"]) = _csr((artist_tfidf[a].items() for a in artists), term_ids)
+
+    # Постинги для поиска: для каждого слова (номер документа, tf) по возрастанию номера
+    postings = [(array("i"), array("i")) for _ in terms]
+    for doc_id, item in enumerate(processed):
+        counts = defaultdict(int)
+        for word in item["tokens"]:
+            counts[word] += 1
+        for word, tf in counts.items():
+            docs, tfs = postings[term_ids[word]]
+            docs.append(doc_id)
+            tfs.append(tf)
+    postings_indptr = array("q", [0])
+    postings_docs = array("i")
+    postings_tfs = array("i")
+    for docs, tfs in postings:
+        postings_docs.extend(docs)
+        postings_tfs.extend(tfs)
+        postings_indptr.append(len(postings_docs))
+    del postings
+    sections["postings_indptr"] = postings_indptr
+    sections["postings_docs"] = postings_docs
+    sections["postings_tfs"] = postings_tfs
+
+    # Топ-k слов песен и артистов
+    (sections["doc_top_indptr"], sections["doc_top_indices"],
+     sections["doc_top_data"]) = _csr((top_k(weights, k) for weights in tfidf_scores), term_ids)
+    (sections["artist_top_indptr"], sections["artist_top_indices"],
+     sections["artist_top_data"]) = _csr((top_k(artist_tfidf[a], k) for a in artists), term_ids)
+
+    # Соседи по косинусному сходству
+    if song_neighbours:
+        song_index = SimilarityIndex(tfidf_scores, **(song_similarity_options or {}))
+        (sections["song_nn_indptr"], sections["song_nn_ids"],
+         sections["song_nn_scores"]) = _neighbour_table(
+            song_index.precompute_neighbours(similar_k), range(len(processed)))
+    artist_index = SimilarityIndex((artist_tfidf[a] for a in artists), keys=artists)
+    (sections["artist_nn_indptr"], sections["artist_nn_ids"],
+     sections["artist_nn_scores"]) = _neighbour_table(
+        artist_index.precompute_neighbours(similar_k), artist_ids)
+
+    header = {
+        "version": MODEL_FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "num_docs": len(processed),
+        "total_tokens": stats.total_tokens,
+        "k": k,
+        "similar_k": similar_k,
+        "rarest": [[word, value, stats.df(word)] for word, value in top_k(idf, k)],
+        "most_frequent": [list(pair) for pair in stats.term_freq.most_common(k)],
+        "meta": meta or {},
+        "sections": {},
+    }
+
+    # Смещения секций зависят от длины заголовка, поэтому считаем их до записи
+    layout = []
+    position = 0
+    for name, values in sections.items():
+        nbytes = len(values) * values.itemsize
+        layout.append((name, position, nbytes, values.typecode))
+        position += nbytes + (-nbytes) % _ALIGN
+    header_size = 0
+    while True:
+        data_start = len(_MAGIC) + _HEADER_LEN.size + header_size
+        data_start += (-data_start) % _ALIGN
+        header["sections"] = {
+            name: [data_start + offset, nbytes, typecode] for name, offset, nbytes, typecode in layout
+        }
+        encoded = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        if len(encoded) <= header_size:
+            break
+        header_size = len(encoded)
+    encoded = encoded.ljust(header_size)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_MAGIC)
+            f.write(_HEADER_LEN.pack(header_size))
+            f.write(encoded)
+            f.write(b"\0" * (data_start - f.tell()))
+            for name, values in sections.items():
+                values.tofile(f)
+                f.write(b"\0" * (-f.tell() % _ALIGN))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class _StringTable(Sequence):
+    """Строки из отображённого файла; декодируются при обращении."""
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return str(self._blob[self._offsets[i]:self._offsets[i + 1]], "utf-8")
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+
+class _MappedVocabulary:
+    """Словарь слово <-> id поверх таблицы строк (как ``sparse_tfidf.Vocabulary``).
+
+    Отображение слово -> id строится при первом поиске по слову.
+    """
+
+    def __init__(self, table):
+        self._table = table
+        self._ids = None
+
+    def get(self, term, default=None):
+        if self._ids is None:
+            self._ids = {t: i for i, t in enumerate(self._table)}
+        return self._ids.get(term, default)
+
+    def term(self, term_id):
+        return self._table[term_id]
+
+    @property
+    def terms(self):
+        return self._table
+
+    def __len__(self):
+        return len(self._table)
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def __iter__(self):
+        return iter(self._table)
+
+
+class _MappedMatrix:
+    """CSR-секции файла в виде, который понимают ``SparseRowView``/``SparseRows``."""
+
+    def __init__(self, vocabulary, indptr, indices, data):
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    @property
+    def num_docs(self):
+        return len(self.indptr) - 1
+
+
+class _SongView(Mapping):
+    """Запись песни (как в ``processed``); текст читается из файла по запросу."""
+
+    _KEYS = ("artist", "song_url", "original_lyrics")
+
+    def __init__(self, model, doc_id):
+        self._model = model
+        self._doc_id = doc_id
+
+    def __getitem__(self, key):
+        model = self._model
+        if key == "artist":
+            return model._artists[model._song_artist[self._doc_id]]
+        if key == "song_url":
+            return model._urls[self._doc_id]
+        if key == "original_lyrics":
+            return model._lyrics[self._doc_id]
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self):
+        return len(self._KEYS)
+
+
+class _Songs(Sequence):
+    def __init__(self, model):
+        self._model = model
+
+    def __getitem__(self, doc_id):
+        if doc_id < 0:
+            doc_id += len(self)
+        if not 0 <= doc_id < len(self):
+            raise IndexError(doc_id)
+        return _SongView(self._model, doc_id)
+
+    def __len__(self):
+        return self._model.num_docs
+
+
+class MappedNeighbours:
+    """Предвычисленные соседи (тот же ``most_similar``, что у ``SimilarityIndex``)."""
+
+    def __init__(self, indptr, ids, scores, k, keys=None):
+        self._indptr = indptr
+        self._ids = ids
+        self._scores = scores
+        self.k = k
+        self.keys = keys
+        self._positions = {key: i for i, key in enumerate(keys)} if keys is not None else None
+
+    def most_similar(self, key, k=10):
+        """k ближайших соседей: ``[(ключ, косинус)]``."""
+        if k > self.k:
+            raise ValueError(f"Предвычислено только {self.k} соседей, запрошено {k}")
+        row = self._positions[key] if self._positions is not None else key
+        start = self._indptr[row]
+        end = min(self._indptr[row + 1], start + k)
+        return [
+            (self.keys[self._ids[pos]] if self.keys is not None else self._ids[pos], self._scores[pos])
+            for pos in range(start, end)
+        ]
+
+
+class MappedModel:
+    """Модель, открытая из файла ``write_model`` через mmap (только чтение).
+
+    Повторяет интерфейс ``QueryIndex`` (топ-списки, песни артиста, df),
+    а также даёт песни (``songs``), веса TF-IDF, постинги для ``SearchIndex``
+    и таблицы соседей.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._open()
+        except BaseException:
+            self._mmap.close()
+            raise
+
+    def _open(self):
+        buffer = self._mmap
+        if buffer[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"{self.path}: не файл модели")
+        (header_size,) = _HEADER_LEN.unpack_from(buffer, len(_MAGIC))
+        start = len(_MAGIC) + _HEADER_LEN.size
+        header = json.loads(bytes(buffer[start:start + header_size]))
+        if header["version"] != MODEL_FORMAT_VERSION:
+            raise ValueError(f"{self.path}: неподдерживаемая версия формата {header['version']}")
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{self.path}: файл записан с другим порядком байт")
+
+        self.header = header
+        self.meta = header["meta"]
+        self.num_docs = header["num_docs"]
+        self.total_tokens = header["total_tokens"]
+        self.k = header["k"]
+        self.similar_k = header["similar_k"]
+        self._rarest = [tuple(entry) for entry in header["rarest"]]
+        self._most_frequent = [tuple(entry) for entry in header["most_frequent"]]
+
+        self._view = memoryview(buffer)
+        self._views = []
+        s = self._section
+        self.vocabulary = _MappedVocabulary(_StringTable(s("terms_blob"), s("terms_offsets")))
+        self._idf = s("idf")
+        self._df = s("df")
+        self._term_freq = s("term_freq")
+        self._artists = _StringTable(s("artists_blob"), s("artists_offsets"))
+        self._song_artist = s("song_artist")
+        self._urls = _StringTable(s("urls_blob"), s("urls_offsets"))
+        self._lyrics = _StringTable(s("lyrics_blob"), s("lyrics_offsets"))
+        self.doc_lengths = s("doc_lengths")
+        self.tfidf = _MappedMatrix(self.vocabulary, s("tfidf_indptr"), s("tfidf_indices"), s("tfidf_data"))
+        self._artist_tfidf = _MappedMatrix(
+            self.vocabulary, s("artist_indptr"), s("artist_indices"), s("artist_data"))
+        self._postings = (s("postings_indptr"), s("postings_docs"), s("postings_tfs"))
+        self._doc_top = (s("doc_top_indptr"), s("doc_top_indices"), s("doc_top_data"))
+        self._artist_top = (s("artist_top_indptr"), s("artist_top_indices"), s("artist_top_data"))
+
+        self.artists = list(self._artists)
+        self._artist_positions = {artist: i for i, artist in enumerate(self.artists)}
+        self.songs = _Songs(self)
+        # Таблица соседей песен необязательна (см. write_model)
+        self.song_neighbours = None
+        if "song_nn_indptr" in header["sections"]:
+            self.song_neighbours = MappedNeighbours(
+                s("song_nn_indptr"), s("song_nn_ids"), s("song_nn_scores"), self.similar_k)
+        self.artist_neighbours = MappedNeighbours(
+            s("artist_nn_indptr"), s("artist_nn_ids"), s("artist_nn_scores"), self.similar_k, keys=self.artists)
+        self._artist_songs = None
+
+    def _section(self, name):
+        offset, nbytes, typecode = self.header["sections"][name]
+        view = self._view[offset:offset + nbytes].cast(typecode)
+        self._views.append(view)
+        return view
+
+    def close(self):
+        """Закрывает отображение; полученные из модели виды становятся недействительны.
+
+        Если где-то ещё остались виды на файл (например, постинги в ``SearchIndex``),
+        отображение освобождается, когда они будут удалены.
+        """
+        for view in self._views:
+            view.release()
+        self._views.clear()
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return self.num_docs
+
+    # Веса и статистика слов
+
+    @property
+    def vocabulary_size(self):
+        return len(self.vocabulary)
+
+    def doc_tfidf(self, doc_id):
+        """Веса TF-IDF песни: ``{слово: вес}`` без копирования."""
+        return SparseRowView(self.tfidf, doc_id)
+
+    def tfidf_rows(self):
+        """Веса всех песен (совместимо со списком словарей)."""
+        return SparseRows(self.tfidf)
+
+    def artist_tfidf(self, artist):
+        return SparseRowView(self._artist_tfidf, self._artist_positions[artist])
+
+    def idf(self, word):
+        term_id = self.vocabulary.get(word)
+        return self._idf[term_id] if term_id is not None else None
+
+    def df(self, word):
+        term_id = self.vocabulary.get(word)
+        return self._df[term_id] if term_id is not None else 0
+
+    def term_freq(self, word):
+        term_id = self.vocabulary.get(word)
+        return self._term_freq[term_id] if term_id is not None else 0
+
+    def lyrics(self, doc_id):
+        return self._lyrics[doc_id]
+
+    def postings(self):
+        """Постинги ``{слово: (номера документов, tf)}`` — виды на файл, для ``SearchIndex``."""
+        indptr, docs, tfs = self._postings
+        terms = self.vocabulary.terms
+        return {
+            terms[term_id]: (docs[indptr[term_id]:indptr[term_id + 1]], tfs[indptr[term_id]:indptr[term_id + 1]])
+            for term_id in range(len(terms))
+        }
+
+    # Интерфейс QueryIndex
+
+    def _limit(self, n):
+        if n > self.k:
+            raise ValueError(f"Предвычислено только {self.k} слов, запрошено {n}")
+        return n
+
+    def _top(self, table, row, n):
+        indptr, indices, data = table
+        start = indptr[row]
+        end = min(indptr[row + 1], start + self._limit(n))
+        return [(self.vocabulary.term(indices[pos]), data[pos]) for pos in range(start, end)]
+
+    def doc_top_words(self, doc_id, n=10):
+        return self._top(self._doc_top, doc_id, n)
+
+    def artist_top_words(self, artist, n=15):
+        row = self._artist_positions.get(artist)
+        return None if row is None else self._top(self._artist_top, row, n)
+
+    def artist_songs(self, artist):
+        """Пары ``(номер документа, название песни)`` артиста."""
+        if self._artist_songs is None:
+            artist_songs = defaultdict(list)
+            for doc_id in range(self.num_docs):
+                artist_songs[self.artists[self._song_artist[doc_id]]].append(
+                    (doc_id, song_title(self._urls[doc_id])))
+            self._artist_songs = dict(artist_songs)
+        return self._artist_songs.get(artist, [])
+
+    def rarest_words(self, n=10):
+        """Тройки ``(слово, idf, df)`` с наибольшим IDF."""
+        return self._rarest[:self._limit(n)]
+
+    def most_frequent(self, n=10):
+        """Пары ``(слово, частота)`` самых частых слов корпуса."""
+        return self._most_frequent[:self._limit(n)]
+
+
+if __name__ == "__main__":
+    # python mapped_model.py model.lyrmodel — сводка по файлу модели
+    with MappedModel(sys.argv[1]) as model:
+        print(f"Песен: {model.num_docs}, артистов: {len(model.artists)}, слов: {model.vocabulary_size}")
+        print(f"Размер файла: {os.path.getsize(model.path) / 2**20:.1f} МиБ")
+        for name, (_, nbytes, typecode) in model.header["sections"].items():
+            print(f"  {name}: {nbytes} байт ({typecode})")
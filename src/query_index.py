@@ -0,0 +1,75 @@
+# query_index.py
+"""Предвычисленные таблицы для быстрых ответов интерфейса.
+
+Streamlit перезапускает скрипт при каждом действии пользователя, поэтому всё,
+что зависит только от корпуса, считается один раз: топ-k слов каждой песни и
+каждого артиста (частичный отбор через кучу, без полной сортировки),
+индекс артист -> песни, документные частоты и самые редкие/частые слова.
+После этого любой запрос интерфейса стоит O(k), а не O(размер корпуса).
+"""
+import heapq
+from collections import defaultdict
+from operator import itemgetter
+
+
+def top_k(weights, k):
+    """k пар ``(слово, вес)`` с наибольшим весом, по убыванию."""
+    return heapq.nlargest(k, weights.items(), key=itemgetter(1))
+
+
+def song_title(song_url):
+    """Название песни из URL Genius."""
+    slug = song_url.split("/")[-1]
+    if slug.endswith("-lyrics"):
+        slug = slug[:-7]
+    return slug.replace("-", " ").title()
+
+
+class QueryIndex:
+    """Таблицы поиска для интерфейса, построенные по обработанному корпусу."""
+
+    def __init__(self, processed, artist_tfidf, word_idf, word_df, word_freq, k=15):
+        self.k = k
+        self.num_docs = len(processed)
+        self._doc_top = [top_k(item["tfidf"], k) for item in processed]
+        self._artist_top = {artist: top_k(weights, k) for artist, weights in artist_tfidf.items()}
+
+        artist_songs = defaultdict(list)
+        for doc_id, item in enumerate(processed):
+            artist_songs[item["artist"]].append((doc_id, song_title(item["song_url"])))
+        self._artist_songs = dict(artist_songs)
+        self.artists = sorted(self._artist_songs)
+
+        self._df = word_df
+        self._rarest = [
+            (word, idf, word_df.get(word, 0))
+            for word, idf in top_k(word_idf, k)
+        ]
+        self._most_frequent = word_freq.most_common(k)
+
+    def _limit(self, n):
+        if n > self.k:
+            raise ValueError(f"Предвычислено только {self.k} слов, запрошено {n}")
+        return n
+
+    def doc_top_words(self, doc_id, n=10):
+        return self._doc_top[doc_id][:self._limit(n)]
+
+    def artist_top_words(self, artist, n=15):
+        top = self._artist_top.get(artist)
+        return None if top is None else top[:self._limit(n)]
+
+    def artist_songs(self, artist):
+        """Пары ``(номер документа, название песни)`` артиста."""
+        return self._artist_songs.get(artist, [])
+
+    def df(self, word):
+        return self._df.get(word, 0)
+
+    def rarest_words(self, n=10):
+        """Тройки ``(слово, idf, df)`` с наибольшим IDF."""
+        return self._rarest[:self._limit(n)]
+
+    def most_frequent(self, n=10):
+        """Пары ``(слово, частота)`` самых частых слов корпуса."""
+        return self._most_frequent[:self._limit(n)]
@@ -1,15 +1,40 @@
 import requests
 from bs4 import BeautifulSoup
 import json
-import time
 import os
+import sys
 from requests.exceptions import RequestException, Timeout
 
+from corpus_io import CorpusWriter
+from crawl_state import CrawlState
+from fetcher import Fetcher
+from lyrics_extractor import ExtractionPool, extract_lyrics
+import instrumentation
+
 # Настройки
 headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (HTML, like Gecko) Chrome/120.0 Safari/537.36"
 }
 
+GENIUS_URL = "https://genius.com"
+
+# Параллельная загрузка: число потоков и вежливый лимит запросов в секунду к одному хосту
+MAX_WORKERS = 8
+REQUESTS_PER_SECOND = 0.5
+MAX_SONGS_PER_ARTIST = 15
+
+# Процессы для разбора страниц (отдельно от сетевых потоков); 0 — разбор в основном процессе
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", "2"))
+
+# Файл состояния обхода (в папке с данными) для возобновления после сбоя
+STATE_FILE = "crawl_state.sqlite"
+
+# Общий корпус в построчном формате (".jsonl.gz" — со сжатием)
+CORPUS_FILE = "lyrics_all.jsonl"
+
+# Отчёт инструментации (пишется при PIPELINE_PROFILE=1)
+PROFILE_FILE = "scrape_profile.json"
+
 # Список артистов (URL-slugs)
 artists = [
    "Taylor-swift",
@@ -35,12 +60,13 @@ artists = [
 ]
 
 output_dir = "lyrics_data"
-os.makedirs(output_dir, exist_ok=True)
+
+_session = requests.Session()
 
 
 def safe_get(url, headers, timeout=10):
     try:
-        return requests.get(url, headers=headers, timeout=timeout)
+        return _session.get(url, headers=headers, timeout=timeout)
     except Timeout:
         print(f" Таймаут: {url}")
         return None
@@ -48,36 +74,40 @@ def safe_get(url, headers, timeout=10):
         print(f" Ошибка сети: {url} — {e}")
         return None
 
-def get_song_links_from_artist(artist_slug, max_songs=15):
-    url = f"https://genius.com/artists/{artist_slug}"
-    response = safe_get(url, headers)
-    if not response:
-        return []
-    soup = BeautifulSoup(response.text, 'html.parser') # создаем объект для парсинга HTML-страницы с BeautifulSoup
+def artist_page_url(artist_slug, base_url=GENIUS_URL):
+    return f"{base_url}/artists/{artist_slug}"
+
+def parse_song_links(html, max_songs=15, base_url=GENIUS_URL):
+    soup = BeautifulSoup(html, 'html.parser') # создаем объект для парсинга HTML-страницы с BeautifulSoup
     links = []
     for a in soup.select('a.mini_card'): # CSS-селектор 'a.mini_card' для поиска ссылок на песни на странице артиста
         href = a.get('href')
-        if href and href.startswith('https://genius.com/') and 'lyrics' in href:
+        if href and href.startswith(base_url + '/') and 'lyrics' in href:
             links.append(href)
         if len(links) >= max_songs:
             break
     return links
 
-def extract_lyrics_from_page(song_url):
-    response = safe_get(song_url, headers)
+def get_song_links_from_artist(artist_slug, max_songs=15, fetcher=None, base_url=GENIUS_URL):
+    url = artist_page_url(artist_slug, base_url)
+    response = fetcher.get(url) if fetcher else safe_get(url, headers)
     if not response:
-        return None
+        return []
+    return parse_song_links(response.text, max_songs, base_url)
 
+def decode_page(response):
     # Принудительно интерпретируем текст как UTF-8, игнорируя недекодируемые байты
     try:
         # response.text уже декодирован, но может содержать "битые" символы
         # Чтобы избежать проблем при сохранении, нормализуем строку
         raw_html = response.content  # получаем байты
-        decoded_html = raw_html.decode('utf-8', errors='ignore')  # безопасная декодировка
+        return raw_html.decode('utf-8', errors='ignore')  # безопасная декодировка
     except UnicodeDecodeError:
         # fallback: используем response.text, но чистим его
-        decoded_html = response.text
+        return response.text
 
+def parse_lyrics(decoded_html):
+    """Эталонный разбор полным деревом BeautifulSoup (см. ``lyrics_extractor``)."""
     soup = BeautifulSoup(decoded_html, 'html.parser')
 
     # Способ 1: через JSON (старый формат)
@@ -109,52 +139,148 @@ def extract_lyrics_from_page(song_url):
 
     return None
 
-# Сбор текстов по артистам
-all_files = []
-
-for artist in artists:
-    print(f"\n Обрабатываем артиста: {artist}")
-    artist_lyrics = []
-    song_links = get_song_links_from_artist(artist, max_songs=15)
-
-    for i, link in enumerate(song_links):
-        print(f"  → Песня {i+1}/{len(song_links)}: {link}")
-        lyrics = extract_lyrics_from_page(link)
-        if lyrics:
-            artist_lyrics.append({
-                "artist": artist,
-                "song_url": link,
-                "lyrics": lyrics
-            })
+def extract_lyrics_from_page(song_url, fetcher=None):
+    response = fetcher.get(song_url) if fetcher else safe_get(song_url, headers)
+    if not response:
+        return None
+    return extract_lyrics(decode_page(response))
+
+def save_artist_lyrics(artist, artist_lyrics):
+    filename = os.path.join(output_dir, f"lyrics_{artist}.json")
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(artist_lyrics, f, ensure_ascii=False, indent=2)
+    print(f"Сохранено {len(artist_lyrics)} текстов → {filename}")
+    return filename
+
+def _resolve_artist_links(artist, response, state, max_songs, base_url):
+    if response is not None and response.status_code == 304 and state is not None:
+        return state.artist_links(artist) or []
+    if not response:
+        # Сеть недоступна — используем сохранённые ссылки, если есть
+        return (state.artist_links(artist) or []) if state is not None else []
+    links = parse_song_links(response.text, max_songs, base_url)
+    if state is not None:
+        state.record_artist(artist, links, response)
+    return links
+
+def _fetch_song(fetcher, link, state, refresh):
+    """Загружает песню с учётом состояния обхода; возвращает Future или None, если загрузка не нужна."""
+    if state is None:
+        return fetcher.submit(link)
+    if not state.has_song(link):
+        return fetcher.submit(link)
+    if refresh:
+        return fetcher.submit(link, state.song_headers(link))
+    return None
+
+def scrape_artists(artists, fetcher, max_songs=MAX_SONGS_PER_ARTIST, base_url=GENIUS_URL,
+                   state=None, refresh=False, on_song=None, extractor=None):
+    """Параллельно собирает тексты песен; выдаёт пары (артист, [записи]) в исходном порядке.
+
+    С ``state`` (``CrawlState``) обход возобновляем: сохранённые песни не
+    загружаются повторно, а при ``refresh`` проверяются условными запросами.
+    ``on_song`` вызывается для каждой найденной песни сразу после её обработки.
+    Страницы разбираются в ``extractor`` (``ExtractionPool``), без него — синхронно.
+    """
+    if extractor is None:
+        extractor = ExtractionPool(workers=0)
+
+    # Страницы артистов загружаются параллельно
+    artist_futures = {}
+    for artist in artists:
+        if state is not None and not refresh and state.artist_links(artist) is not None:
+            continue
+        artist_headers = state.artist_headers(artist) if state is not None else None
+        artist_futures[artist] = fetcher.submit(artist_page_url(artist, base_url), artist_headers)
+
+    song_links = {}
+    for artist in artists:
+        if artist in artist_futures:
+            song_links[artist] = _resolve_artist_links(
+                artist, artist_futures[artist].result(), state, max_songs, base_url)
         else:
-            print(f"Текст не найден")
-        time.sleep(2)  # уважаем сервер
-
-    # Сохраняем по артисту
-    if artist_lyrics:
-        filename = os.path.join(output_dir, f"lyrics_{artist}.json")
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(artist_lyrics, f, ensure_ascii=False, indent=2)
-        print(f"Сохранено {len(artist_lyrics)} текстов → {filename}")
-        all_files.append(filename)
-    else:
-        print(f"Нет текстов для {artist}")
-
-# Объединение всех файлов в один общий
-
-print(f"\nОбъединяем все файлы в один общий корпус...")
-
-full_corpus = []
-for file in all_files:
-    with open(file, "r", encoding="utf-8") as f:
-        data = json.load(f)
-        full_corpus.extend(data)
-
-# Сохраняем общий файл
-final_path = os.path.join(output_dir, "lyrics_all.json")
-with open(final_path, "w", encoding="utf-8") as f:
-    json.dump(full_corpus, f, ensure_ascii=False, indent=2)
-
-print(f"Готово! Всего собрано {len(full_corpus)} текстов.")
-print(f"Все файлы сохранены в папке: {output_dir}")
-print(f"Общий файд: {final_path}")
\ No newline at end of file
+            song_links[artist] = state.artist_links(artist)
+        print(f" {artist}: найдено {len(song_links[artist])} песен")
+
+    # Песни всех артистов загружаются в общем пуле; дубликаты ссылок пропускаются
+    seen = set()
+    futures = {}
+    for artist in artists:
+        futures[artist] = []
+        for link in song_links[artist]:
+            if link in seen:
+                continue
+            seen.add(link)
+            futures[artist].append((link, _fetch_song(fetcher, link, state, refresh)))
+
+    for artist in artists:
+        print(f"\n Обрабатываем артиста: {artist}")
+        # Сначала отдаём на разбор все загруженные страницы артиста,
+        # чтобы разбор шёл параллельно с ожиданием остальных ответов
+        pending = []
+        for link, future in futures[artist]:
+            response = future.result() if future is not None else None
+            parsed = None
+            if response and response.status_code != 304:
+                parsed = extractor.submit(response.content)
+            pending.append((link, future, response, parsed))
+
+        artist_lyrics = []
+        for i, (link, future, response, parsed) in enumerate(pending):
+            print(f"  → Песня {i+1}/{len(pending)}: {link}")
+            if future is None:
+                lyrics = state.song_lyrics(link)
+            elif response is not None and response.status_code == 304:
+                state.touch_song(link)
+                lyrics = state.song_lyrics(link)
+            else:
+                lyrics = parsed.result() if parsed is not None else None
+                if state is not None and lyrics:
+                    state.record_song(link, artist, lyrics, response)
+            if lyrics:
+                record = {
+                    "artist": artist,
+                    "song_url": link,
+                    "lyrics": lyrics
+                }
+                artist_lyrics.append(record)
+                if on_song is not None:
+                    on_song(record)
+            else:
+                print(f"Текст не найден")
+        yield artist, artist_lyrics
+
+def main(refresh=False):
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Общий корпус пишется построчно по мере сбора песен
+    final_path = os.path.join(output_dir, CORPUS_FILE)
+
+    # Сбор текстов по артистам
+    with Fetcher(headers, max_workers=MAX_WORKERS, rate_per_host=REQUESTS_PER_SECOND) as fetcher, \
+            CrawlState(os.path.join(output_dir, STATE_FILE)) as state, \
+            CorpusWriter(final_path) as corpus, \
+            ExtractionPool(workers=PARSE_WORKERS) as extractor:
+        for artist, artist_lyrics in scrape_artists(artists, fetcher, state=state, refresh=refresh,
+                                                    on_song=corpus.write, extractor=extractor):
+            # Сохраняем по артисту
+            if artist_lyrics:
+                save_artist_lyrics(artist, artist_lyrics)
+            else:
+                print(f"Нет текстов для {artist}")
+        total = corpus.count
+
+    if instrumentation.is_enabled():
+        # PIPELINE_PROFILE=1: задержки и объёмы HTTP-запросов
+        profile_path = os.path.join(output_dir, PROFILE_FILE)
+        instrumentation.export_json(profile_path)
+        print(f"Профиль загрузки: {profile_path}")
+
+    print(f"Готово! Всего собрано {total} текстов.")
+    print(f"Все файлы сохранены в папке: {output_dir}")
+    print(f"Общий файл: {final_path}")
+
+
+if __name__ == "__main__":
+    # --refresh: перепроверить уже сохранённые страницы условными запросами
+    main(refresh="--refresh" in sys.argv)
@@ -0,0 +1,220 @@
+# search.py
+"""Ранжированный поиск по текстам песен (BM25 или TF-IDF).
+
+Индекс хранит для каждого слова постинги ``(номер документа, tf)``,
+отсортированные по номеру документа. Top-k отбирается алгоритмом MaxScore:
+для каждого слова заранее известен максимальный вклад в оценку, и слова,
+которые в сумме не могут поднять документ выше текущего k-го результата,
+не перебираются целиком, а только проверяются бинарным поиском.
+Запрос нормализуется той же функцией, что и корпус (``clean_and_normalize``).
+
+Совпадение MaxScore с полным перебором проверяется на случайном корпусе:
+``python search.py`` (см. ``check_maxscore``).
+"""
+import heapq
+import math
+import random
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+
+class SearchIndex:
+    """Инвертированный индекс с ранжированием BM25/TF-IDF и ранним отсечением."""
+
+    def __init__(self, corpus_tokens, scoring="bm25", k1=1.2, b=0.75, analyzer=None):
+        if scoring not in ("bm25", "tfidf"):
+            raise ValueError(f"Неизвестная схема ранжирования: {scoring}")
+        self.scoring = scoring
+        self.k1 = k1
+        self.b = b
+        self._analyzer = analyzer
+
+        postings = {}
+        doc_lengths = array("l")
+        for doc_id, doc_tokens in enumerate(corpus_tokens):
+            for word, tf in Counter(doc_tokens).items():
+                entry = postings.get(word)
+                if entry is None:
+                    entry = postings[word] = (array("l"), array("l"))
+                entry[0].append(doc_id)
+                entry[1].append(tf)
+            doc_lengths.append(len(doc_tokens))
+        self._build(postings, doc_lengths)
+
+    @classmethod
+    def from_postings(cls, postings, doc_lengths, scoring="bm25", k1=1.2, b=0.75, analyzer=None):
+        """Индекс по готовым постингам ``{слово: (номера документов, tf)}``.
+
+        Номера документов должны идти по возрастанию; подойдут любые
+        последовательности (например, виды на файл ``MappedModel``).
+        """
+        index = cls((), scoring=scoring, k1=k1, b=b, analyzer=analyzer)
+        index._build(postings, doc_lengths)
+        return index
+
+    def _build(self, postings, doc_lengths):
+        self.doc_lengths = doc_lengths
+        self.num_docs = len(self.doc_lengths)
+        self.avg_doc_length = sum(self.doc_lengths) / self.num_docs if self.num_docs else 0.0
+
+        # Для каждого слова: постинги, idf и максимальный вклад в оценку
+        self._terms = {}
+        for word, (docs, tfs) in postings.items():
+            idf = self._idf(len(docs))
+            upper_bound = max(self._score(idf, tf, self.doc_lengths[doc]) for doc, tf in zip(docs, tfs))
+            self._terms[word] = (docs, tfs, idf, upper_bound)
+
+    def _idf(self, df):
+        N = self.num_docs
+        if self.scoring == "bm25":
+            return math.log(1 + (N - df + 0.5) / (df + 0.5))
+        return math.log(N / df)
+
+    def _score(self, idf, tf, doc_length):
+        if self.scoring == "bm25":
+            norm = self.k1 * (1 - self.b + self.b * doc_length / self.avg_doc_length)
+            return idf * tf * (self.k1 + 1) / (tf + norm)
+        return tf / doc_length * idf
+
+    def df(self, word):
+        entry = self._terms.get(word)
+        return len(entry[0]) if entry else 0
+
+    def postings(self, word):
+        """Пары ``(номер документа, tf)`` слова."""
+        entry = self._terms.get(word)
+        return list(zip(entry[0], entry[1])) if entry else []
+
+    def analyze(self, text):
+        """Нормализация запроса тем же конвейером, что и корпус."""
+        if self._analyzer is None:
+            from text_processor import clean_and_normalize
+            self._analyzer = clean_and_normalize
+        return self._analyzer(text)
+
+    def search(self, text, k=10):
+        """Top-k документов по текстовому запросу: ``[(номер документа, оценка)]``."""
+        return self.search_tokens(self.analyze(text), k)
+
+    def search_tokens(self, query_tokens, k=10):
+        """Top-k по уже нормализованным словам запроса (алгоритм MaxScore)."""
+        terms = [self._terms[word] for word in dict.fromkeys(query_tokens) if word in self._terms]
+        if not terms or k <= 0:
+            return []
+        # Слова по возрастанию максимального вклада; cum_bounds[i] — сумма вкладов слов 0..i
+        terms.sort(key=lambda term: term[3])
+        cum_bounds = []
+        total = 0.0
+        for term in terms:
+            total += term[3]
+            cum_bounds.append(total)
+
+        n = len(terms)
+        cursors = [0] * n
+        heap = []
+        threshold = 0.0
+        first_essential = 0
+        doc_lengths = self.doc_lengths
+
+        while True:
+            # Слова 0..first_essential-1 вместе не могут превысить порог — "необязательные"
+            while first_essential < n and cum_bounds[first_essential] <= threshold:
+                first_essential += 1
+            if first_essential == n:
+                break
+
+            # Следующий документ-кандидат — минимальный среди "обязательных" списков
+            doc = None
+            for i in range(first_essential, n):
+                docs = terms[i][0]
+                if cursors[i] < len(docs) and (doc is None or docs[cursors[i]] < doc):
+                    doc = docs[cursors[i]]
+            if doc is None:
+                break
+
+            doc_length = doc_lengths[doc]
+            score = 0.0
+            for i in range(first_essential, n):
+                docs, tfs, idf, _ = terms[i]
+                pos = cursors[i]
+                if pos < len(docs) and docs[pos] == doc:
+                    score += self._score(idf, tfs[pos], doc_length)
+                    cursors[i] = pos + 1
+
+            # Добираем вклад "необязательных" слов, пока документ может пройти порог
+            for i in range(first_essential - 1, -1, -1):
+                if score + cum_bounds[i] <= threshold:
+                    break
+                docs, tfs, idf, _ = terms[i]
+                pos = bisect_left(docs, doc, cursors[i])
+                cursors[i] = pos
+                if pos < len(docs) and docs[pos] == doc:
+                    score += self._score(idf, tfs[pos], doc_length)
+
+            if len(heap) < k:
+                heapq.heappush(heap, (score, -doc))
+                if len(heap) == k:
+                    threshold = heap[0][0]
+            elif score > threshold:
+                heapq.heapreplace(heap, (score, -doc))
+                threshold = heap[0][0]
+
+        return [(-neg_doc, score) for score, neg_doc in sorted(heap, reverse=True)]
+
+    def search_exhaustive(self, query_tokens, k=10):
+        """Полный перебор без отсечения (эталон для проверки ``search_tokens``).
+
+        Документы с нулевой оценкой (например, только со словом из всех
+        документов при ``scoring="tfidf"``) не возвращаются, как и в MaxScore.
+        """
+        scores = Counter()
+        for word in dict.fromkeys(query_tokens):
+            entry = self._terms.get(word)
+            if entry is None:
+                continue
+            docs, tfs, idf, _ = entry
+            for doc, tf in zip(docs, tfs):
+                scores[doc] += self._score(idf, tf, self.doc_lengths[doc])
+        ranked = sorted(((doc, score) for doc, score in scores.items() if score > 0),
+                        key=lambda item: (-item[1], item[0]))
+        return ranked[:k]
+
+
+def check_maxscore(num_docs=500, num_queries=300, vocab_size=300, seed=0):
+    """Сравнивает ``search_tokens`` (MaxScore) с ``search_exhaustive`` на случайном корпусе.
+
+    Слова корпуса и запросов выбираются с перекосом в сторону частых, чтобы
+    отсечение действительно срабатывало; слово "common" есть в каждом
+    документе (при ``scoring="tfidf"`` его idf равен нулю). Проверяются обе
+    схемы ранжирования и разные k. Возвращает список расхождений ``(схема, запрос, k)``.
+    """
+    rng = random.Random(seed)
+    vocabulary = [f"w{i}" for i in range(vocab_size)]
+    weights = [1.0 / (rank + 1) for rank in range(vocab_size)]
+    corpus = [rng.choices(vocabulary, weights, k=rng.randint(1, 60)) + ["common"] for _ in range(num_docs)]
+    queries = [rng.choices(vocabulary, weights, k=rng.randint(1, 6)) for _ in range(num_queries)]
+    queries += [["common"] + query for query in queries[:num_queries // 4]]
+    queries += [["unknown"], ["common"], ["common", vocabulary[-1]]]
+
+    mismatches = []
+    for scoring in ("bm25", "tfidf"):
+        index = SearchIndex(corpus, scoring=scoring)
+        for query in queries:
+            for k in (1, 5, 10):
+                expected = index.search_exhaustive(query, k)
+                actual = index.search_tokens(query, k)
+                # Документы с равной оценкой могут идти в любом порядке: сравниваем оценки
+                if len(expected) != len(actual) or any(
+                        not math.isclose(e[1], a[1], rel_tol=1e-9) for e, a in zip(expected, actual)):
+                    mismatches.append((scoring, query, k))
+    return mismatches
+
+
+if __name__ == "__main__":
+    mismatches = check_maxscore()
+    for scoring, query, k in mismatches[:10]:
+        print(f"Расхождение ({scoring}, k={k}): {' '.join(query)}")
+    print(f"Расхождений MaxScore с полным перебором: {len(mismatches)}")
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,282 @@
+# sharded_tfidf.py
+"""Пакетный TF-IDF для корпусов, не помещающихся в память одного процесса.
+
+Корпус читается потоком и делится на шарды по ``shard_size`` песен.
+1. Map: каждый шард нормализуется в отдельном процессе; на диск пишутся
+   счётчики слов его песен, а в основной процесс возвращаются только
+   документные частоты шарда.
+2. Reduce: частоты шардов складываются в глобальные; словарь ограничивается
+   порогами ``min_df``/``max_df``, по нему считается IDF.
+3. Веса TF-IDF считаются и записываются шард за шардом (снова в пуле процессов).
+
+В памяти одновременно находятся лишь несколько шардов. С ``n_features``
+слова заменяются номерами признаков (хэширование), и размер словаря и IDF
+фиксирован независимо от объёма корпуса. Без порогов и хэширования веса
+совпадают с ``tfidf.compute_tfidf``.
+"""
+import argparse
+import json
+import math
+import os
+import pickle
+import sys
+import zlib
+from array import array
+from collections import Counter
+
+from corpus_io import iter_corpus
+from instrumentation import span
+
+# Песни с меньшим числом токенов после нормализации отбрасываются (как в app.py)
+MIN_SONG_TOKENS = 10
+
+MANIFEST_FILE = "manifest.json"
+VOCABULARY_FILE = "vocabulary.bin"
+
+
+def feature_index(word, n_features):
+    """Номер признака слова при хэшировании (стабилен между процессами и запусками)."""
+    return zlib.crc32(word.encode("utf-8")) % n_features
+
+
+def _doc_count_limit(value, num_docs):
+    """Порог ``min_df``/``max_df``: целое — число песен, дробное — доля корпуса."""
+    if isinstance(value, float):
+        if not 0.0 <= value <= 1.0:
+            raise ValueError("Доля документов должна быть в диапазоне [0, 1]")
+        return value * num_docs
+    if value < 0:
+        raise ValueError("Порог числа документов не может быть отрицательным")
+    return value
+
+
+def _write_blob(path, obj):
+    with open(path, "wb") as f:
+        f.write(zlib.compress(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)))
+
+
+def _read_blob(path):
+    with open(path, "rb") as f:
+        return pickle.loads(zlib.decompress(f.read()))
+
+
+def _shard_path(out_dir, shard_id, kind):
+    return os.path.join(out_dir, f"shard-{shard_id:05d}.{kind}")
+
+
+def _map_shard(out_dir, shard_id, records, analyzer, min_tokens, n_features):
+    """Нормализация шарда: счётчики слов песен -> файл, документные частоты -> результат."""
+    if analyzer is None:
+        from text_processor import clean_and_normalize
+        analyzer = clean_and_normalize
+
+    songs = []
+    doc_lengths = array("l")
+    doc_counts = []
+    df = Counter()
+    for item in records:
+        lyrics = item.get("lyrics")
+        if not lyrics or not isinstance(lyrics, str):
+            continue
+        tokens = analyzer(lyrics)
+        if len(tokens) < min_tokens:
+            continue
+        if n_features:
+            counts = Counter(feature_index(word, n_features) for word in tokens)
+        else:
+            counts = Counter(tokens)
+        df.update(counts.keys())
+        songs.append({"artist": item.get("artist"), "song_url": item.get("song_url")})
+        doc_lengths.append(len(tokens))
+        doc_counts.append(counts)
+
+    _write_blob(_shard_path(out_dir, shard_id, "counts"), {
+        "songs": songs,
+        "doc_lengths": doc_lengths,
+        "counts": doc_counts,
+    })
+    return shard_id, len(songs), df
+
+
+# IDF для процессов, считающих веса (задаётся один раз при старте процесса)
+_worker_idf = None
+
+
+def _init_weight_worker(idf):
+    global _worker_idf
+    _worker_idf = idf
+
+
+def _weight_shard(out_dir, shard_id):
+    """Веса TF-IDF шарда в CSR (номера слов по общему словарю); файл счётчиков удаляется."""
+    counts_path = _shard_path(out_dir, shard_id, "counts")
+    shard = _read_blob(counts_path)
+    idf = _worker_idf
+    indptr = array("q", [0])
+    indices = array("l")
+    data = array("d")
+    for counts, length in zip(shard["counts"], shard["doc_lengths"]):
+        for term, count in counts.items():
+            entry = idf.get(term)
+            if entry is None:  # слово отсечено порогами min_df/max_df
+                continue
+            term_id, term_idf = entry
+            indices.append(term_id)
+            data.append(count / length * term_idf)
+        indptr.append(len(indices))
+    _write_blob(_shard_path(out_dir, shard_id, "tfidf"), {
+        "songs": shard["songs"],
+        "indptr": indptr,
+        "indices": indices,
+        "data": data,
+    })
+    os.remove(counts_path)
+    return shard_id, len(indices)
+
+
+def _iter_shards(records, shard_size):
+    shard = []
+    for item in records:
+        shard.append(item)
+        if len(shard) >= shard_size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
+def compute_sharded_tfidf(records, out_dir, shard_size=5000, workers=None, min_df=1, max_df=1.0,
+                          n_features=None, min_tokens=MIN_SONG_TOKENS, analyzer=None):
+    """Вычисляет TF-IDF по шардам и записывает результат в каталог ``out_dir``.
+
+    ``records`` — итерируемый источник записей корпуса (например, ``iter_corpus``);
+    ``min_df``/``max_df`` — пороги документной частоты (целое — число песен,
+    дробное — доля корпуса); ``n_features`` включает хэширование слов.
+    ``analyzer`` (по умолчанию ``clean_and_normalize``) должен сериализоваться
+    pickle, так как передаётся в процессы. Возвращает манифест (он же
+    записывается в ``manifest.json``).
+    """
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    if shard_size < 1:
+        raise ValueError("shard_size должен быть положительным")
+    if workers is None:
+        workers = os.cpu_count() or 1
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Map: одновременно в обработке не больше 2 * workers шардов
+    shard_docs = {}
+    df = [0] * n_features if n_features else Counter()
+    with span("sharded.map") as s, ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+
+        def collect(done):
+            for future in done:
+                shard_id, num_docs, shard_df = future.result()
+                shard_docs[shard_id] = num_docs
+                if n_features:
+                    for feature, count in shard_df.items():
+                        df[feature] += count
+                else:
+                    df.update(shard_df)
+
+        for shard_id, shard in enumerate(_iter_shards(records, shard_size)):
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(executor.submit(_map_shard, out_dir, shard_id, shard, analyzer, min_tokens, n_features))
+        collect(pending)
+        s.items = sum(shard_docs.values())
+
+    # Reduce: общий словарь с порогами и IDF
+    num_docs = sum(shard_docs.values())
+    low = _doc_count_limit(min_df, num_docs)
+    high = _doc_count_limit(max_df, num_docs)
+    with span("sharded.reduce"):
+        seen_terms = sum(1 for count in df if count) if n_features else len(df)
+        if n_features:
+            kept = [(feature, count) for feature, count in enumerate(df) if count and low <= count <= high]
+        else:
+            kept = sorted((word, count) for word, count in df.items() if low <= count <= high)
+        terms = [term for term, _ in kept]
+        doc_freq = array("q", (count for _, count in kept))
+        idf_values = array("d", (math.log(num_docs / count) for _, count in kept))
+        idf = {term: (term_id, idf_values[term_id]) for term_id, term in enumerate(terms)}
+        _write_blob(os.path.join(out_dir, VOCABULARY_FILE), {"terms": terms, "df": doc_freq, "idf": idf_values})
+        del df
+
+    # Веса: шард за шардом, IDF передаётся в каждый процесс один раз
+    shard_ids = sorted(shard_docs)
+    with span("sharded.weights", items=num_docs), \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_weight_worker, initargs=(idf,)) as executor:
+        nnz = sum(count for _, count in executor.map(_weight_shard, [out_dir] * len(shard_ids), shard_ids))
+
+    manifest = {
+        "num_docs": num_docs,
+        "shards": [
+            {"file": os.path.basename(_shard_path(out_dir, shard_id, "tfidf")), "num_docs": shard_docs[shard_id]}
+            for shard_id in shard_ids
+        ],
+        "vocabulary_size": len(terms),
+        "pruned_terms": seen_terms - len(terms),
+        "nnz": nnz,
+        "min_df": min_df,
+        "max_df": max_df,
+        "n_features": n_features,
+        "min_tokens": min_tokens,
+    }
+    with open(os.path.join(out_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def load_manifest(out_dir):
+    with open(os.path.join(out_dir, MANIFEST_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_vocabulary(out_dir):
+    """Словарь результата: ``{"terms": [...], "df": array, "idf": array}``.
+
+    При хэшировании ``terms`` — номера признаков.
+    """
+    return _read_blob(os.path.join(out_dir, VOCABULARY_FILE))
+
+
+def iter_sharded_tfidf(out_dir):
+    """Потоково выдаёт пары ``(запись песни, {слово: вес})`` шард за шардом."""
+    terms = load_vocabulary(out_dir)["terms"]
+    for shard in load_manifest(out_dir)["shards"]:
+        weights = _read_blob(os.path.join(out_dir, shard["file"]))
+        indptr, indices, data = weights["indptr"], weights["indices"], weights["data"]
+        for i, song in enumerate(weights["songs"]):
+            yield song, {terms[indices[pos]]: data[pos] for pos in range(indptr[i], indptr[i + 1])}
+
+
+def _parse_df(value):
+    return float(value) if "." in value else int(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TF-IDF по шардам для больших корпусов")
+    parser.add_argument("corpus", help="файл корпуса (.jsonl, .jsonl.gz или .json)")
+    parser.add_argument("out_dir", help="каталог для результата")
+    parser.add_argument("--shard-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--min-df", type=_parse_df, default=1, help="целое — число песен, дробное — доля")
+    parser.add_argument("--max-df", type=_parse_df, default=1.0, help="целое — число песен, дробное — доля")
+    parser.add_argument("--features", type=int, default=None, help="хэширование слов в заданное число признаков")
+    args = parser.parse_args(argv)
+
+    manifest = compute_sharded_tfidf(
+        iter_corpus(args.corpus), args.out_dir, shard_size=args.shard_size, workers=args.workers,
+        min_df=args.min_df, max_df=args.max_df, n_features=args.features,
+    )
+    print(f"Песен: {manifest['num_docs']}, шардов: {len(manifest['shards'])}, "
+          f"словарь: {manifest['vocabulary_size']} (отсечено {manifest['pruned_terms']}), "
+          f"ненулевых весов: {manifest['nnz']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+# similarity.py
+"""Поиск ближайших соседей (косинусное сходство) по векторам TF-IDF.
+
+Векторы нормируются по L2, после чего косинус — это просто скалярное
+произведение. Соседи ищутся через инвертированный индекс: для каждого
+слова запроса проходим только документы, где это слово есть, и накапливаем
+частичные скалярные произведения.
+
+Слова с большим df (почти нулевой IDF) дают длинные постинги и почти
+ничего не добавляют к сходству, а полный обход их постингов делает поиск
+квадратичным по размеру корпуса. Поэтому индекс можно ограничить:
+``max_df`` исключает из постингов слишком частые слова, ``max_postings``
+оставляет у слова только самые весомые документы, ``max_query_terms``
+ограничивает запрос самыми весомыми словами. Тогда постинги дают лишь
+кандидатов, а ``rerank`` лучших из них пересчитываются точно по полным
+векторам. Таблицу соседей можно предвычислить, тогда запрос стоит O(k).
+"""
+import heapq
+import math
+from array import array
+from operator import itemgetter
+
+
+def l2_normalize(weights):
+    """Вектор ``{слово: вес}`` единичной длины (пустой — для нулевого)."""
+    norm = math.sqrt(sum(w * w for w in weights.values()))
+    if norm == 0:
+        return {}
+    return {word: w / norm for word, w in weights.items()}
+
+
+class SimilarityIndex:
+    """Инвертированный индекс нормированных векторов для top-k по косинусу.
+
+    ``vectors`` — последовательность отображений ``{слово: вес}`` (например,
+    результат ``compute_tfidf``), ``keys`` — их идентификаторы (по умолчанию
+    номера). Без ограничений (``max_query_terms``, ``max_df``, ``max_postings``)
+    результат точный; с ними постинги дают кандидатов, из которых ``rerank``
+    (на каждый запрошенный результат) пересчитываются точно — быстрее на
+    больших корпусах, но соседи становятся приближёнными.
+    """
+
+    def __init__(self, vectors, keys=None, max_query_terms=None, max_df=None, max_postings=None,
+                 rerank=10):
+        self.keys = list(keys) if keys is not None else None
+        self.max_query_terms = max_query_terms
+        self.max_df = max_df
+        self.max_postings = max_postings
+        self.rerank = rerank
+        self.approximate = any(v is not None for v in (max_query_terms, max_df, max_postings))
+
+        self._term_ids = {}
+        self._vectors = []
+        doc_freq = []
+        for weights in vectors:
+            vector = {}
+            for word, w in l2_normalize(weights).items():
+                if w == 0:  # слово с нулевым IDF не влияет на сходство
+                    continue
+                term_id = self._term_ids.get(word)
+                if term_id is None:
+                    term_id = self._term_ids[word] = len(self._term_ids)
+                    doc_freq.append(0)
+                doc_freq[term_id] += 1
+                vector[term_id] = w
+            self._vectors.append(vector)
+
+        # Постинги: без слов, встречающихся чаще max_df (доля корпуса). Короткие постинги
+        # (не длиннее max_postings) дёшевы, поэтому на небольших корпусах слова не отбрасываются
+        max_doc_count = None
+        if self.max_df is not None:
+            max_doc_count = max(self.max_df * len(self._vectors), self.max_postings or 0)
+        postings_docs = [array("l") for _ in doc_freq]
+        postings_weights = [array("d") for _ in doc_freq]
+        for doc_id, vector in enumerate(self._vectors):
+            for term_id, w in vector.items():
+                if max_doc_count is not None and doc_freq[term_id] > max_doc_count:
+                    continue
+                postings_docs[term_id].append(doc_id)
+                postings_weights[term_id].append(w)
+        if self.max_postings is not None:
+            # У каждого слова остаются только самые весомые документы
+            for term_id, docs in enumerate(postings_docs):
+                if len(docs) > self.max_postings:
+                    top = heapq.nlargest(self.max_postings, zip(postings_weights[term_id], docs))
+                    postings_weights[term_id] = array("d", (w for w, _ in top))
+                    postings_docs[term_id] = array("l", (doc for _, doc in top))
+        self._postings = list(zip(postings_docs, postings_weights))
+
+        self._neighbours = None
+        self._neighbours_k = 0
+        self._positions = None
+        if self.keys is not None:
+            if len(self.keys) != len(self._vectors):
+                raise ValueError("Число ключей не совпадает с числом векторов")
+            self._positions = {key: i for i, key in enumerate(self.keys)}
+
+    def __len__(self):
+        return len(self._vectors)
+
+    def _key(self, doc_id):
+        return self.keys[doc_id] if self.keys is not None else doc_id
+
+    def _position(self, key):
+        if self._positions is None:
+            return key
+        return self._positions[key]
+
+    def _search(self, vector, k, exclude=None):
+        """``vector`` — словарь ``{id слова: вес}`` нормированного запроса."""
+        terms = vector.items()
+        if self.max_query_terms is not None and len(vector) > self.max_query_terms:
+            terms = heapq.nlargest(self.max_query_terms, terms, key=itemgetter(1))
+        scores = {}
+        for term_id, q_weight in terms:
+            docs, weights = self._postings[term_id]
+            for doc_id, d_weight in zip(docs, weights):
+                scores[doc_id] = scores.get(doc_id, 0.0) + q_weight * d_weight
+        if exclude is not None:
+            scores.pop(exclude, None)
+
+        if self.approximate:
+            # Частичные суммы — только отбор кандидатов; лучшие пересчитываются точно
+            candidates = heapq.nlargest(k * self.rerank, scores, key=scores.__getitem__)
+            vectors = self._vectors
+            scores = {
+                doc_id: sum(q_weight * vectors[doc_id].get(term_id, 0.0) for term_id, q_weight in vector.items())
+                for doc_id in candidates
+            }
+        top = heapq.nlargest(k, scores.items(), key=itemgetter(1))
+        return [(self._key(doc_id), score) for doc_id, score in top]
+
+    def most_similar(self, key, k=10):
+        """k ближайших соседей элемента индекса (без него самого): ``[(ключ, косинус)]``."""
+        doc_id = self._position(key)
+        if self._neighbours is not None and k <= self._neighbours_k:
+            return self._neighbours[doc_id][:k]
+        return self._search(self._vectors[doc_id], k, exclude=doc_id)
+
+    def query(self, weights, k=10):
+        """k ближайших к произвольному вектору ``{слово: вес}``."""
+        vector = {
+            self._term_ids[word]: w
+            for word, w in l2_normalize(weights).items()
+            if word in self._term_ids
+        }
+        return self._search(vector, k)
+
+    def precompute_neighbours(self, k=10):
+        """Строит таблицу k соседей для всех элементов (для пакетных задач и интерфейса)."""
+        table = [self._search(vector, k, exclude=doc_id) for doc_id, vector in enumerate(self._vectors)]
+        self._neighbours = table
+        self._neighbours_k = k
+        return table
@@ -0,0 +1,277 @@
+# sparse_tfidf.py
+"""Разреженное (CSR) хранилище TF-IDF для больших корпусов.
+
+Вместо списка словарей ``{слово: вес}`` корпус хранится как словарь
+терминов (слово <-> целочисленный id) и три плоских буфера в формате CSR:
+``indptr`` (границы строк), ``indices`` (id терминов) и ``data`` (веса).
+Если установлен NumPy, TF, IDF и TF-IDF считаются векторно; без него
+используются буферы модуля ``array`` и обычные циклы.
+"""
+import math
+from array import array
+from collections.abc import Mapping, Sequence
+
+_NUMPY_UNSET = object()
+_np = _NUMPY_UNSET
+
+
+def _numpy():
+    """NumPy, если установлен (импортируется лениво, при первом построении матрицы)."""
+    global _np
+    if _np is _NUMPY_UNSET:
+        try:
+            import numpy
+        except ImportError:  # NumPy не обязателен
+            numpy = None
+        _np = numpy
+    return _np
+
+
+class Vocabulary:
+    """Двунаправленное отображение слово <-> целочисленный id."""
+
+    def __init__(self, terms=()):
+        self._ids = {}
+        self._terms = []
+        for term in terms:
+            self.add(term)
+
+    def add(self, term):
+        """Возвращает id слова, добавляя его при необходимости."""
+        term_id = self._ids.get(term)
+        if term_id is None:
+            term_id = len(self._terms)
+            self._ids[term] = term_id
+            self._terms.append(term)
+        return term_id
+
+    def get(self, term, default=None):
+        return self._ids.get(term, default)
+
+    def term(self, term_id):
+        return self._terms[term_id]
+
+    @property
+    def terms(self):
+        return self._terms
+
+    def __len__(self):
+        return len(self._terms)
+
+    def __contains__(self, term):
+        return term in self._ids
+
+    def __iter__(self):
+        return iter(self._terms)
+
+
+class SparseRowView(Mapping):
+    """Словарный вид одной строки матрицы: ``{слово: вес}`` без копирования.
+
+    Для поиска по слову при первом обращении строится таблица
+    id термина -> позиция в строке, дальше поиск стоит O(1).
+    """
+
+    def __init__(self, matrix, row):
+        self._matrix = matrix
+        self._start = matrix.indptr[row]
+        self._end = matrix.indptr[row + 1]
+        self._positions = None
+
+    def _pairs(self):
+        vocab = self._matrix.vocabulary
+        indices = self._matrix.indices
+        data = self._matrix.data
+        for pos in range(self._start, self._end):
+            yield vocab.term(int(indices[pos])), float(data[pos])
+
+    def _position(self, word):
+        term_id = self._matrix.vocabulary.get(word)
+        if term_id is None:
+            return None
+        if self._positions is None:
+            indices = self._matrix.indices
+            self._positions = {int(indices[pos]): pos for pos in range(self._start, self._end)}
+        return self._positions.get(term_id)
+
+    def __getitem__(self, word):
+        pos = self._position(word)
+        if pos is None:
+            raise KeyError(word)
+        return float(self._matrix.data[pos])
+
+    def get(self, word, default=None):
+        pos = self._position(word)
+        return default if pos is None else float(self._matrix.data[pos])
+
+    def __contains__(self, word):
+        return self._position(word) is not None
+
+    def __iter__(self):
+        for word, _ in self._pairs():
+            yield word
+
+    def __len__(self):
+        return int(self._end - self._start)
+
+    def items(self):
+        return list(self._pairs())
+
+    def values(self):
+        data = self._matrix.data
+        return [float(data[pos]) for pos in range(self._start, self._end)]
+
+
+class SparseRows(Sequence):
+    """Совместимый со списком словарей вид всей матрицы."""
+
+    def __init__(self, matrix):
+        self._matrix = matrix
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return SparseRowView(self._matrix, row)
+
+    def __len__(self):
+        return self._matrix.num_docs
+
+
+class SparseTfidfMatrix:
+    """Корпус в формате CSR: счётчики слов, IDF и веса TF-IDF."""
+
+    def __init__(self, vocabulary, indptr, indices, counts):
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.indices = indices
+        self.counts = counts
+        self.idf = None
+        self.data = None
+        self._compute()
+
+    @classmethod
+    def from_corpus(cls, corpus_tokens, vocabulary=None):
+        """Строит матрицу за один проход по спискам токенов."""
+        if vocabulary is None:
+            vocabulary = Vocabulary()
+        indptr = array("q", [0])
+        indices = array("l")
+        counts = array("l")
+        for doc_tokens in corpus_tokens:
+            doc_counts = {}
+            for word in doc_tokens:
+                term_id = vocabulary.add(word)
+                doc_counts[term_id] = doc_counts.get(term_id, 0) + 1
+            indices.extend(doc_counts.keys())
+            counts.extend(doc_counts.values())
+            indptr.append(len(indices))
+        np = _numpy()
+        if np is not None:
+            indptr = np.frombuffer(indptr, dtype=np.int64).copy()
+            indices = np.frombuffer(indices, dtype=np.dtype(indices.typecode)).astype(np.int32)
+            counts = np.frombuffer(counts, dtype=np.dtype(counts.typecode)).astype(np.int32)
+        return cls(vocabulary, indptr, indices, counts)
+
+    @classmethod
+    def from_weights(cls, vocabulary, indptr, indices, data, idf=None):
+        """Матрица по уже вычисленным весам (например, из кэша артефактов).
+
+        Счётчики слов в такой матрице отсутствуют, поэтому ``tf_row`` недоступен.
+        """
+        matrix = cls.__new__(cls)
+        matrix.vocabulary = vocabulary
+        matrix.indptr = indptr
+        matrix.indices = indices
+        matrix.counts = None
+        matrix.idf = idf
+        matrix.data = data
+        return matrix
+
+    @property
+    def num_docs(self):
+        return len(self.indptr) - 1
+
+    @property
+    def shape(self):
+        return self.num_docs, len(self.vocabulary)
+
+    def _compute(self):
+        """Векторно вычисляет TF, IDF и TF-IDF."""
+        if _numpy() is not None and not isinstance(self.indptr, array):
+            self._compute_numpy()
+        else:
+            self._compute_python()
+
+    def _compute_numpy(self):
+        np = _numpy()
+        N = self.num_docs
+        row_ids = np.repeat(np.arange(N), np.diff(self.indptr))
+        totals = np.bincount(row_ids, weights=self.counts, minlength=N)
+        tf = self.counts / totals[row_ids]
+
+        df = np.bincount(self.indices, minlength=len(self.vocabulary))
+        idf = np.zeros(len(self.vocabulary), dtype=np.float64)
+        present = df > 0
+        idf[present] = np.log(N / df[present])
+
+        self.idf = idf
+        self.data = tf * idf[self.indices]
+
+    def _compute_python(self):
+        N = self.num_docs
+        df = array("l", [0]) * len(self.vocabulary)
+        for term_id in self.indices:
+            df[term_id] += 1
+        self.idf = array("d", (math.log(N / d) if d else 0.0 for d in df))
+
+        data = array("d")
+        indptr, counts, indices, idf = self.indptr, self.counts, self.indices, self.idf
+        for row in range(N):
+            start, end = indptr[row], indptr[row + 1]
+            total = sum(counts[start:end])
+            for pos in range(start, end):
+                data.append(counts[pos] / total * idf[indices[pos]])
+        self.data = data
+
+    def tf_row(self, row):
+        """TF одной строки как словарь ``{слово: tf}``."""
+        if self.counts is None:
+            raise ValueError("Матрица построена по готовым весам, счётчиков слов в ней нет")
+        start, end = self.indptr[row], self.indptr[row + 1]
+        total = sum(int(c) for c in self.counts[start:end])
+        return {
+            self.vocabulary.term(int(self.indices[pos])): int(self.counts[pos]) / total
+            for pos in range(start, end)
+        }
+
+    def idf_dict(self):
+        """IDF всех слов как словарь ``{слово: idf}``."""
+        if self.idf is None:
+            raise ValueError("IDF для этой матрицы не сохранён")
+        return {term: float(self.idf[i]) for i, term in enumerate(self.vocabulary)}
+
+    def row(self, row):
+        """Словарный вид TF-IDF одной строки."""
+        return SparseRowView(self, row)
+
+    def rows(self):
+        """Вид всей матрицы, совместимый с результатом ``compute_tfidf``."""
+        return SparseRows(self)
+
+    def nbytes(self):
+        """Объём числовых буферов в байтах (без словаря терминов)."""
+        total = 0
+        for buf in (self.indptr, self.indices, self.counts, self.data, self.idf):
+            if buf is None:
+                continue
+            total += buf.itemsize * len(buf) if isinstance(buf, array) else buf.nbytes
+        return total
+
+
+def compute_sparse_tfidf(corpus_tokens, vocabulary=None):
+    """Вычисляет TF-IDF корпуса в разреженном формате."""
+    return SparseTfidfMatrix.from_corpus(corpus_tokens, vocabulary=vocabulary)
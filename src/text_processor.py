@@ -1,68 +1,378 @@
 # text_processor.py
+import functools
+import os
 import re
-import nltk
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-from nltk.stem import WordNetLemmatizer
-import ssl
-
-# Отключаем SSL проверку для загрузки NLTK данных (иногда нужно)
-try:
-    _create_unverified_https_context = ssl._create_unverified_context
-except AttributeError:
-    pass
-else:
-    ssl._create_default_https_context = _create_unverified_https_context
-
-def download_nltk_data():
-    """Загружает необходимые NLTK-ресурсы с обработкой ошибок."""
+import sys
+import threading
+
+from instrumentation import span
+
+# NLTK импортируется лениво (при первой нормализации), чтобы импорт модуля
+# и холодный старт приложения не платили за загрузку nltk.
+
+# Режим "прогретых" ресурсов: данные NLTK проверены при сборке (prewarm),
+# во время работы наличие не проверяется и ничего не скачивается
+NLTK_PREWARMED = os.environ.get("NLTK_PREWARMED") == "1"
+
+def _allow_unverified_ssl():
+    """Отключаем SSL проверку для загрузки NLTK данных (иногда нужно)."""
+    import ssl
     try:
-        # Пробуем найти уже скачанные данные
-        nltk.data.find('tokenizers/punkt')
-        nltk.data.find('corpora/stopwords')
-        nltk.data.find('corpora/wordnet')
-    except LookupError:
-        # Загружаем данные в пользовательскую папку
-        import os
-        nltk_data_dir = os.path.join(os.path.expanduser("~"), "nltk_data")
-        
-        # Создаем папку, если ее нет
-        if not os.path.exists(nltk_data_dir):
-            os.makedirs(nltk_data_dir)
-        
-        # Загружаем необходимые пакеты
-        nltk.download('punkt', quiet=True, download_dir=nltk_data_dir)
-        nltk.download('stopwords', quiet=True, download_dir=nltk_data_dir)
-        nltk.download('wordnet', quiet=True, download_dir=nltk_data_dir)
-        
-        # Добавляем путь к данным NLTK
-        nltk.data.path.append(nltk_data_dir)
+        _create_unverified_https_context = ssl._create_unverified_context
+    except AttributeError:
+        pass
+    else:
+        ssl._create_default_https_context = _create_unverified_https_context
 
-def clean_and_normalize(text):
-    """Очистка и нормализация английского текста."""
-    # Гарантируем, что данные NLTK загружены
-    download_nltk_data()
+# NLTK-пакеты и пути, по которым проверяется их наличие
+NLTK_RESOURCES = {
+    'punkt': 'tokenizers/punkt',
+    'stopwords': 'corpora/stopwords',
+    'wordnet': 'corpora/wordnet',
+}
+
+# Токенизаторы: "nltk" — word_tokenize (нужен punkt), "fast" — один проход регулярным выражением
+TOKENIZERS = ('nltk', 'fast')
+DEFAULT_TOKENIZER = os.environ.get("TEXT_TOKENIZER", "nltk")
+
+def download_nltk_data(packages=tuple(NLTK_RESOURCES)):
+    """Загружает необходимые NLTK-ресурсы с обработкой ошибок."""
+    if NLTK_PREWARMED:
+        return
+    import nltk
+    missing = []
+    for package in packages:
+        try:
+            # Пробуем найти уже скачанные данные
+            nltk.data.find(NLTK_RESOURCES[package])
+        except LookupError:
+            missing.append(package)
+    if not missing:
+        return
+
+    # Загружаем данные в пользовательскую папку
+    nltk_data_dir = os.path.join(os.path.expanduser("~"), "nltk_data")
+    
+    # Создаем папку, если ее нет
+    if not os.path.exists(nltk_data_dir):
+        os.makedirs(nltk_data_dir)
     
-    if not isinstance(text, str):
-        return []
+    # Загружаем необходимые пакеты
+    _allow_unverified_ssl()
+    for package in missing:
+        nltk.download(package, quiet=True, download_dir=nltk_data_dir)
     
+    # Добавляем путь к данным NLTK
+    nltk.data.path.append(nltk_data_dir)
+
+
+def prewarm():
+    """Проверка (и загрузка) всех NLTK-ресурсов при сборке образа.
+
+    После неё приложение можно запускать с ``NLTK_PREWARMED=1``: проверки
+    файловой системы и загрузки во время работы не выполняются.
+    Возвращает список ресурсов, которых по-прежнему не хватает.
+    """
+    import nltk
+    global NLTK_PREWARMED
+    NLTK_PREWARMED = False
+    download_nltk_data()
+    missing = []
+    for package, resource in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            missing.append(package)
+    if not missing:
+        # Прогреваем и ленивую загрузку WordNet, чтобы убедиться, что корпус читается
+        from nltk.stem import WordNetLemmatizer
+        WordNetLemmatizer().lemmatize('songs')
+    return missing
+
+
+_WORD_RE = re.compile(r'[a-z]+')
+
+# Слитные формы, которые word_tokenize (правила Treebank) делит на две части
+# даже в тексте из одних букв; быстрый токенизатор повторяет это для совместимости
+_TREEBANK_SPLITS = {
+    'cannot': ('can', 'not'),
+    'gimme': ('gim', 'me'),
+    'gonna': ('gon', 'na'),
+    'gotta': ('got', 'ta'),
+    'lemme': ('lem', 'me'),
+    'wanna': ('wan', 'na'),
+}
+
+def nltk_tokenize(text):
+    """Исходная токенизация: только буквы и пробелы, затем NLTK word_tokenize."""
     text = text.lower()
     text = re.sub(r'[^a-z\s]', ' ', text)  # оставить только буквы и пробелы
-    
-    # Токенизация
-    tokens = word_tokenize(text)
-    
-    # Загружаем стоп-слова
-    stop_words = set(stopwords.words('english'))
-    
-    # Лемматизация
-    lemmatizer = WordNetLemmatizer()
-    
-    # Фильтрация
-    tokens = [
-        lemmatizer.lemmatize(w)
-        for w in tokens
-        if w not in stop_words and len(w) > 2
-    ]
-    
+    from nltk.tokenize import word_tokenize
+    return word_tokenize(text)
+
+def fast_tokenize(text):
+    """Быстрая токенизация одним проходом; совпадает с ``nltk_tokenize`` по токенам."""
+    tokens = []
+    for match in _WORD_RE.finditer(text.lower()):
+        word = match.group()
+        parts = _TREEBANK_SPLITS.get(word)
+        if parts:
+            tokens.extend(parts)
+        else:
+            tokens.append(word)
     return tokens
+
+class TextProcessor:
+    """Переиспользуемый конвейер нормализации текста.
+
+    NLTK-ресурсы, множество стоп-слов и лемматизатор загружаются один раз
+    (при первом использовании, под блокировкой), а результаты лемматизации
+    повторяющихся словоформ кэшируются в ограниченном LRU-кэше.
+    Экземпляр можно безопасно использовать из нескольких потоков.
+    """
+
+    def __init__(self, lemma_cache_size=50000, min_length=3, tokenizer='nltk'):
+        if tokenizer not in TOKENIZERS:
+            raise ValueError(f"Неизвестный токенизатор: {tokenizer}")
+        self.lemma_cache_size = lemma_cache_size
+        self.min_length = min_length
+        self.tokenizer = tokenizer
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._stop_words = None
+        self._lemmatize = None
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            # Быстрому токенизатору punkt не нужен
+            if self.tokenizer == 'nltk':
+                download_nltk_data()
+            else:
+                download_nltk_data(('stopwords', 'wordnet'))
+            from nltk.corpus import stopwords
+            from nltk.stem import WordNetLemmatizer
+            self._stop_words = frozenset(stopwords.words('english'))
+            lemmatizer = WordNetLemmatizer()
+            # WordNet загружается лениво и не потокобезопасно — прогреваем здесь
+            lemmatizer.lemmatize('songs')
+            self._lemmatize = functools.lru_cache(maxsize=self.lemma_cache_size)(lemmatizer.lemmatize)
+            self._loaded = True
+
+    def lemmatize(self, word):
+        """Лемматизация слова с кэшированием."""
+        if not self._loaded:
+            self._load()
+        return self._lemmatize(word)
+
+    def normalize(self, text):
+        """Очистка и нормализация одного текста."""
+        if not isinstance(text, str):
+            return []
+        if not self._loaded:
+            self._load()
+
+        stop_words = self._stop_words
+        lemmatize = self._lemmatize
+        min_length = self.min_length
+
+        if self.tokenizer == 'fast':
+            # Токенизация, фильтрация и лемматизация за один проход
+            with span("tokenize_lemmatize") as s:
+                tokens = []
+                for match in _WORD_RE.finditer(text.lower()):
+                    word = match.group()
+                    for w in _TREEBANK_SPLITS.get(word, (word,)):
+                        if w not in stop_words and len(w) >= min_length:
+                            tokens.append(lemmatize(w))
+                s.items = len(tokens)
+            return tokens
+
+        # Токенизация
+        with span("tokenize"):
+            tokens = nltk_tokenize(text)
+
+        # Фильтрация и лемматизация
+        with span("lemmatize") as s:
+            tokens = [
+                lemmatize(w)
+                for w in tokens
+                if w not in stop_words and len(w) >= min_length
+            ]
+            s.items = len(tokens)
+        return tokens
+
+    def normalize_many(self, texts):
+        """Нормализация набора текстов с общими ресурсами."""
+        with span("normalize_many") as s:
+            results = [self.normalize(text) for text in texts]
+            s.items = len(results)
+        return results
+
+    def settings(self):
+        """Параметры конструктора: по ним процессы-обработчики создают такой же экземпляр."""
+        return {
+            "lemma_cache_size": self.lemma_cache_size,
+            "min_length": self.min_length,
+            "tokenizer": self.tokenizer,
+        }
+
+    def cache_info(self):
+        """Статистика LRU-кэша лемматизации."""
+        return self._lemmatize.cache_info() if self._loaded else None
+
+
+_default_processor = None
+_default_processor_lock = threading.Lock()
+
+
+def get_default_processor():
+    """Общий для модуля экземпляр ``TextProcessor``."""
+    global _default_processor
+    if _default_processor is None:
+        with _default_processor_lock:
+            if _default_processor is None:
+                _default_processor = TextProcessor(tokenizer=DEFAULT_TOKENIZER)
+    return _default_processor
+
+
+def clean_and_normalize(text):
+    """Очистка и нормализация английского текста."""
+    return get_default_processor().normalize(text)
+
+
+def normalize_many(texts, processor=None, workers=1, chunksize=256):
+    """Очистка и нормализация набора текстов.
+
+    При ``workers`` > 1 (или ``None`` — по числу ядер) тексты обрабатываются
+    в пуле процессов, см. ``normalize_parallel``.
+    """
+    if workers != 1:
+        return normalize_parallel(texts, workers=workers, chunksize=chunksize, processor=processor)
+    if processor is None:
+        processor = get_default_processor()
+    return processor.normalize_many(texts)
+
+
+# Экземпляр TextProcessor процесса-обработчика (задаётся при старте процесса)
+_worker_processor = None
+
+
+def _init_worker(settings=None):
+    """Инициализация процесса-обработчика: ресурсы NLTK загружаются один раз.
+
+    ``settings`` — ``TextProcessor.settings()`` экземпляра вызывающего;
+    без них используется общий экземпляр модуля.
+    """
+    global _worker_processor
+    _worker_processor = TextProcessor(**settings) if settings is not None else get_default_processor()
+    _worker_processor._load()
+
+
+def _normalize_chunk(texts):
+    return _worker_processor.normalize_many(texts)
+
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def normalize_parallel(texts, workers=None, chunksize=256, processor=None):
+    """Параллельная нормализация текстов в пуле процессов.
+
+    Тексты делятся на блоки по ``chunksize``; каждый процесс загружает
+    NLTK-ресурсы один раз при старте. Процессы создают ``TextProcessor``
+    с настройками ``processor`` (по умолчанию — общий экземпляр модуля).
+    Порядок результатов совпадает с порядком входных текстов.
+    """
+    results = []
+    with span("normalize_parallel") as s:
+        results.extend(iter_normalize_parallel(texts, workers=workers, chunksize=chunksize, processor=processor))
+        s.items = len(results)
+    return results
+
+
+def iter_normalize(texts, processor=None, workers=1, chunksize=256):
+    """Потоковая нормализация: выдаёт токены текстов по одному, в исходном порядке.
+
+    При ``workers`` > 1 (или ``None``) работает через ``iter_normalize_parallel``.
+    """
+    if workers != 1:
+        yield from iter_normalize_parallel(texts, workers=workers, chunksize=chunksize, processor=processor)
+        return
+    if processor is None:
+        processor = get_default_processor()
+    for text in texts:
+        yield processor.normalize(text)
+
+
+def iter_normalize_parallel(texts, workers=None, chunksize=256, processor=None):
+    """Потоковый вариант ``normalize_parallel`` для итератора текстов любой длины.
+
+    Один пул процессов живёт всё время обхода; в обработке одновременно
+    не больше ``2 * workers`` блоков, поэтому источник читается по мере
+    готовности результатов, а не целиком.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunksize < 1:
+        raise ValueError("chunksize должен быть положительным")
+    settings = processor.settings() if processor is not None else None
+    if processor is None:
+        processor = get_default_processor()
+    if workers <= 1:
+        for text in texts:
+            yield processor.normalize(text)
+        return
+
+    # Ресурсы проверяем (и при необходимости скачиваем) до запуска процессов,
+    # чтобы обработчики не скачивали их одновременно
+    processor._load()
+
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(settings,)) as executor:
+        pending = deque()
+        for chunk in _chunked(texts, chunksize):
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+            pending.append(executor.submit(_normalize_chunk, chunk))
+        while pending:
+            yield from pending.popleft().result()
+
+
+def check_tokenizer_parity(texts):
+    """Сравнивает токенизаторы "nltk" и "fast"; возвращает расхождения.
+
+    Список троек ``(номер текста, токены nltk, токены fast)`` — пустой,
+    если оба токенизатора дают одинаковые токены для всех текстов.
+    """
+    download_nltk_data(('punkt',))
+    mismatches = []
+    for i, text in enumerate(texts):
+        if not isinstance(text, str):
+            continue
+        expected = nltk_tokenize(text)
+        actual = fast_tokenize(text)
+        if expected != actual:
+            mismatches.append((i, expected, actual))
+    return mismatches
+
+
+if __name__ == "__main__":
+    # python text_processor.py --prewarm — проверка ресурсов NLTK при сборке образа
+    if "--prewarm" in sys.argv:
+        missing = prewarm()
+        if missing:
+            print(f"Не удалось загрузить ресурсы NLTK: {', '.join(missing)}")
+            sys.exit(1)
+        print("Ресурсы NLTK готовы; запускайте приложение с NLTK_PREWARMED=1")
@@ -1,6 +1,98 @@
 # tfidf.py
 import math
-from collections import defaultdict
+from array import array
+from collections import Counter, defaultdict
+
+from instrumentation import timed
+
+
+class _DocumentFrequencies:
+    """Общие запросы к документным частотам: нужны атрибуты ``doc_freq`` и ``num_docs``."""
+
+    def df(self, word):
+        """Количество документов, содержащих слово."""
+        return self.doc_freq.get(word, 0)
+
+    def idf(self, word):
+        """IDF одного слова; для слов вне корпуса — 0.0."""
+        containing_docs = self.df(word)
+        if containing_docs == 0:
+            return 0.0
+        return math.log(self.num_docs / containing_docs)
+
+    def idf_dict(self):
+        """IDF всех слов корпуса."""
+        idf_dict = defaultdict(float)
+        N = self.num_docs
+        for word, containing_docs in self.doc_freq.items():
+            idf_dict[word] = math.log(N / containing_docs)
+        return idf_dict
+
+    def vocabulary(self):
+        """Все слова корпуса."""
+        return self.doc_freq.keys()
+
+    def __len__(self):
+        return len(self.doc_freq)
+
+    def __contains__(self, word):
+        return word in self.doc_freq
+
+
+class CorpusStats(_DocumentFrequencies):
+    """Статистика корпуса, собираемая за один потоковый проход.
+
+    Частоты слов во всём корпусе, документные частоты, IDF, общее число
+    токенов и длины документов — O(словарь + число документов) памяти.
+    С ``postings=True`` дополнительно хранятся постинги (номера документов
+    каждого слова по возрастанию).
+    """
+
+    def __init__(self, corpus_tokens=(), postings=False):
+        self.num_docs = 0
+        self.total_tokens = 0
+        self.term_freq = Counter()
+        self.doc_freq = Counter()
+        self.doc_lengths = array("l")
+        self._postings = defaultdict(list) if postings else None
+        for doc_tokens in corpus_tokens:
+            self.add_document(doc_tokens)
+
+    @classmethod
+    def from_counts(cls, doc_freq, term_freq, doc_lengths):
+        """Статистика по готовым счётчикам (например, из кэша артефактов), без прохода по токенам."""
+        stats = cls()
+        stats.doc_freq = Counter(doc_freq)
+        stats.term_freq = Counter(term_freq)
+        stats.doc_lengths = array("l", doc_lengths)
+        stats.num_docs = len(stats.doc_lengths)
+        stats.total_tokens = sum(stats.doc_lengths)
+        return stats
+
+    def add_document(self, doc_tokens):
+        """Учитывает документ и возвращает его номер."""
+        doc_id = self.num_docs
+        counts = Counter(doc_tokens)
+        self.term_freq.update(counts)
+        self.doc_freq.update(counts.keys())
+        if self._postings is not None:
+            for word in counts:
+                self._postings[word].append(doc_id)
+        length = len(doc_tokens)
+        self.doc_lengths.append(length)
+        self.total_tokens += length
+        self.num_docs += 1
+        return doc_id
+
+    def postings(self, word):
+        """Номера документов, содержащих слово (по возрастанию); нужен ``postings=True``."""
+        if self._postings is None:
+            raise ValueError("Постинги не собирались: создайте CorpusStats(..., postings=True)")
+        return tuple(self._postings.get(word, ()))
+
+    @property
+    def mean_doc_length(self):
+        return self.total_tokens / self.num_docs if self.num_docs else 0.0
 
 
 def compute_tf(doc_tokens):
@@ -15,48 +107,170 @@ def compute_tf(doc_tokens):
         tf_dict[word] /= total
     return tf_dict
 
-def compute_idf(corpus_tokens):
-    """Вычисляет Inverse Document Frequency для всего корпуса."""
-    N = len(corpus_tokens)
-    idf_dict = defaultdict(float)
-    all_words = set(word for doc in corpus_tokens for word in doc)
-    for word in all_words:
-        containing_docs = sum(1 for doc in corpus_tokens if word in doc)
-        if containing_docs == 0:
-            idf_dict[word] = 0.0
-        else:
-            idf_dict[word] = math.log(N / containing_docs)
-    return idf_dict
+@timed("tfidf.compute_idf")
+def compute_idf(corpus_tokens=None, index=None):
+    """Вычисляет Inverse Document Frequency для всего корпуса.
 
+    Можно передать готовый ``CorpusStats``, чтобы не строить его заново.
+    """
+    if index is None:
+        index = CorpusStats(corpus_tokens)
+    return index.idf_dict()
 
-def compute_tfidf(corpus_tokens):
+
+@timed("tfidf.compute_tfidf")
+def compute_tfidf(corpus_tokens, index=None, idf=None):
     """Вычисляет TF-IDF для всего корпуса."""
-    idf = compute_idf(corpus_tokens)
-    tfidf_corpus = []
+    if idf is None:
+        idf = compute_idf(corpus_tokens, index=index)
+    return list(iter_tfidf(corpus_tokens, idf))
+
+
+def iter_tfidf(corpus_tokens, idf):
+    """Генератор TF-IDF по документам при уже известном IDF.
+
+    Позволяет обрабатывать корпус потоком: IDF считается первым проходом
+    (``CorpusStats`` принимает любой итерируемый источник),
+    веса — вторым, без хранения всех результатов в памяти.
+    """
     for doc_tokens in corpus_tokens:
         tf = compute_tf(doc_tokens)
-        tfidf = {word: tf[word] * idf[word] for word in tf}
-        tfidf_corpus.append(tfidf)
-    return tfidf_corpus
+        yield {word: tf[word] * idf[word] for word in tf}
 
 
-def compute_artist_tfidf(processed_data):
-    """Вычисляет TF-IDF для каждого артиста (объединяя все его песни)."""
-    # Группируем песни по артистам
-    artist_songs = defaultdict(list)
+@timed("tfidf.compute_group_tfidf")
+def compute_group_tfidf(processed_data, key="artist", index=None, idf=None):
+    """Вычисляет TF-IDF для групп документов (артист, альбом, год и т.д.).
+
+    Все документы группы объединяются в один "документ" для TF, а IDF
+    считается один раз по всему корпусу песен и общий для всех групп.
+    ``key`` — имя поля записи или функция ``item -> группа``.
+    """
+    get_group = key if callable(key) else (lambda item: item[key])
+
+    # Один проход: счётчики слов по группам и (при необходимости) индекс df
+    build_index = idf is None and index is None
+    if build_index:
+        index = CorpusStats()
+    group_counts = defaultdict(lambda: defaultdict(int))
+    group_totals = defaultdict(int)
     for item in processed_data:
-        artist_songs[item["artist"]].extend(item["tokens"])
+        tokens = item["tokens"]
+        group = get_group(item)
+        counts = group_counts[group]
+        for word in tokens:
+            counts[word] += 1
+        group_totals[group] += len(tokens)
+        if build_index:
+            index.add_document(tokens)
+
+    if idf is None:
+        idf = compute_idf(index=index)
+
+    group_tfidf = {}
+    for group, counts in group_counts.items():
+        total = group_totals[group]
+        if total == 0:
+            group_tfidf[group] = {}
+            continue
+        group_tfidf[group] = {word: count / total * idf.get(word, 0.0) for word, count in counts.items()}
+    return group_tfidf
+
+
+def compute_artist_tfidf(processed_data, index=None, idf=None):
+    """Вычисляет TF-IDF для каждого артиста (объединяя все его песни)."""
+    return compute_group_tfidf(processed_data, key="artist", index=index, idf=idf)
+
+
+class IncrementalTfidfModel(_DocumentFrequencies):
+    """TF-IDF с добавлением и удалением документов без полного пересчёта.
+
+    Хранит счётчики слов каждого документа и глобальные df/N, поэтому
+    добавление и удаление стоят O(длина документа). Веса считаются при
+    чтении; IDF слов и уже вычисленные веса кэшируются до следующего
+    изменения модели. Результат совпадает с ``compute_tfidf`` по тому же
+    набору документов.
+    """
+
+    def __init__(self):
+        self._counts = {}
+        self._totals = {}
+        self.doc_freq = Counter()
+        self._next_id = 0
+        # Номер версии модели: меняется при каждом добавлении/удалении
+        self._version = 0
+        # Кэши, действительные для версии _cache_version: IDF слов и веса документов
+        self._cache_version = 0
+        self._idf_cache = {}
+        self._weights = {}
+
+    @property
+    def num_docs(self):
+        return len(self._counts)
+
+    def add_documents(self, docs, doc_ids=None):
+        """Добавляет документы (списки токенов) и возвращает их id."""
+        if doc_ids is None:
+            added = []
+            for doc_tokens in docs:
+                added.append(self._add(self._next_id, doc_tokens))
+            return added
+        return [self._add(doc_id, doc_tokens) for doc_id, doc_tokens in zip(doc_ids, docs)]
+
+    def _add(self, doc_id, doc_tokens):
+        if doc_id in self._counts:
+            raise KeyError(f"Документ {doc_id!r} уже есть в модели")
+        if isinstance(doc_id, int) and doc_id >= self._next_id:
+            self._next_id = doc_id + 1
+        counts = Counter(doc_tokens)
+        self._counts[doc_id] = counts
+        self._totals[doc_id] = len(doc_tokens)
+        self.doc_freq.update(counts.keys())
+        self._version += 1
+        return doc_id
+
+    def remove_documents(self, doc_ids):
+        """Удаляет документы по id."""
+        for doc_id in doc_ids:
+            counts = self._counts.pop(doc_id)
+            del self._totals[doc_id]
+            doc_freq = self.doc_freq
+            for word in counts:
+                if doc_freq[word] == 1:
+                    del doc_freq[word]
+                else:
+                    doc_freq[word] -= 1
+            self._version += 1
 
-    # Вычисляем TF-IDF для каждого артиста
-    artist_tfidf = {}
-    for artist, tokens in artist_songs.items():
-        tf = compute_tf(tokens)
-        # Для IDF используем весь корпус (все песни всех артистов)
-        corpus_tokens = [item["tokens"] for item in processed_data]
-        idf = compute_idf(corpus_tokens)
+    def _check_cache(self):
+        if self._cache_version != self._version:
+            self._idf_cache.clear()
+            self._weights.clear()
+            self._cache_version = self._version
 
-        artist_tfidf[artist] = {word: tf[word] * idf[word] for word in tf}
+    def doc_ids(self):
+        return list(self._counts)
 
-    return artist_tfidf
+    def tfidf(self, doc_id):
+        """TF-IDF одного документа."""
+        self._check_cache()
+        weights = self._weights.get(doc_id)
+        if weights is not None:
+            return weights
 
+        counts = self._counts[doc_id]
+        total = self._totals[doc_id]
+        idf_cache = self._idf_cache
+        N = self.num_docs
+        weights = {}
+        for word, count in counts.items():
+            word_idf = idf_cache.get(word)
+            if word_idf is None:
+                word_idf = idf_cache[word] = math.log(N / self.doc_freq[word])
+            weights[word] = count / total * word_idf
+        self._weights[doc_id] = weights
+        return weights
 
+    def tfidf_corpus(self):
+        """TF-IDF всех документов в порядке добавления."""
+        return [self.tfidf(doc_id) for doc_id in self._counts]